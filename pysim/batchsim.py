@@ -0,0 +1,523 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from sim import (
+    Adder,
+    BusConnect,
+    Clock,
+    Counter,
+    IncRegister,
+    IORegister,
+    MemDisplay,
+    Multiplexer,
+    PagedRamController,
+    Power,
+    Ram,
+    Register,
+    RNG,
+    Rom,
+    SplitRegister,
+)
+
+# Runs N copies of a circuit in lockstep, e.g. the same CPU with different RAM
+# images or RNG seeds.
+#
+# The circuit is built, reset and loaded as normal, and BatchSimulation then takes a
+# snapshot of it. From there on, pin and net state are NumPy arrays with one column
+# per instance, and every component is replaced by a batched implementation that
+# does the same thing as its update() for all instances at once (see `batched`).
+# Each delta cycle resolves every net, then evaluates every component that has a
+# NotifySignal pin that changed (in any instance), until nothing changes.
+#
+# The one difference from the scalar simulator is that a net with several drivers
+# gets the OR of them, and there's no contention check.
+
+# Component class -> BatchedComponent subclass.
+_IMPLEMENTATIONS = {}
+
+
+# Registers a batched implementation for a component class.
+def batched(cls):
+    def register(impl):
+        _IMPLEMENTATIONS[cls] = impl
+        return impl
+
+    return register
+
+
+# The batched implementation for a component. A subclass uses its base class's
+# (e.g. SparseRam uses Ram's) as long as it doesn't override update() or any of
+# its signals' handlers, which would change what the implementation has to do.
+def _implementation(component):
+    cls = type(component)
+    for base in cls.__mro__:
+        if base in _IMPLEMENTATIONS:
+            break
+    else:
+        return None
+    names = ["update"] + [
+        s._handler.__name__
+        for s in component.__dict__.values()
+        if getattr(s, "_handler", None) is not None
+    ]
+    for name in names:
+        if getattr(cls, name, None) is not getattr(base, name, None):
+            return None
+    return _IMPLEMENTATIONS[base]
+
+
+def _dtype(width):
+    for t in (np.uint8, np.uint16, np.uint32):
+        if width <= np.iinfo(t).bits:
+            return t
+    return np.uint64
+
+
+# Base class for batched implementations. The constructor copies the state of the
+# scalar component, and update() is called whenever one of its NotifySignals has
+# changed in any instance. Values are int64 arrays with one entry per instance.
+class BatchedComponent:
+    def __init__(self, bs, component):
+        self.bs = bs
+        self.component = component
+        # Value each input pin had when the component last looked at it.
+        self._prev = {i: bs._pin_value[i].copy() for i in bs._inputs(component)}
+
+    def update(self):
+        pass
+
+    def value(self, signal):
+        return self.bs.value(signal)
+
+    # Which instances have pin i of the signal now at v, but didn't when the
+    # component last checked. As in the scalar simulator, an edge whose handler
+    # samples the other inputs is only seen once the rest of the circuit has
+    # settled (see BatchSimulation.settle).
+    def had_edge(self, signal, i, v):
+        if signal._samples and not self.bs._sampling:
+            return np.zeros(self.bs.n, dtype=bool)
+        pin = signal._ids[i]
+        cur = self.bs._pin_value[pin].copy()
+        prev = self._prev[pin]
+        self._prev[pin] = cur
+        return (cur == v) & (prev != v)
+
+    # Drive the signal to v (an array or int) in the instances where enable is set,
+    # and release it in the others.
+    def drive(self, signal, v, enable=True):
+        self.bs._drive(signal, v, enable)
+
+    def release(self, signal):
+        self.bs._drive(signal, 0, False)
+
+
+class BatchSimulation:
+    def __init__(self, clock, n, seed=None, max_deltas=1000):
+        if np is None:
+            raise Exception("Batched simulation requires numpy")
+        if n < 1:
+            raise ValueError(f"Invalid number of instances: {n}")
+        sim = clock._sim
+        nl = sim.netlist
+        if not nl.frozen:
+            sim.freeze()
+        self.n = n
+        self.max_deltas = max_deltas
+        self.rng = np.random.default_rng(seed)
+        self.deltas = 0
+        # Instances that are still running, and how many ticks each has run for.
+        self.active = np.ones(n, dtype=bool)
+        self.cycles = np.zeros(n, dtype=np.int64)
+
+        # Unconnected pins get a net of their own.
+        pin_net = np.array(nl.pin_net, dtype=np.int64)
+        loose = np.flatnonzero(pin_net < 0)
+        pin_net[loose] = len(nl.nets) + np.arange(len(loose))
+        self._pin_net = pin_net
+        n_nets = len(nl.nets) + len(loose)
+
+        # Nets are resolved by OR-ing together the first pin of every net, then the
+        # second pin of every net that has one, and so on.
+        order = np.argsort(pin_net, kind="stable")
+        counts = np.bincount(pin_net, minlength=n_nets)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self._first = order[starts]
+        self._rank = []
+        for k in range(1, counts.max()):
+            nets = np.flatnonzero(counts > k)
+            self._rank.append((nets, order[starts[nets] + k]))
+        pull = np.full(n_nets, -1, dtype=np.int8)
+        for k, net in enumerate(nl.nets):
+            if net._pull is not None:
+                pull[k] = net._pull
+        self._pulled = np.flatnonzero(pull >= 0)
+        self._pull = pull[self._pulled, None].astype(np.uint8)
+
+        # Per-pin state, as in the Netlist: the value each pin reads, whether it's
+        # driving, and what it's driving (zero if not).
+        value = np.frombuffer(bytes(nl.value), dtype=np.uint8)
+        drive = 1 - np.frombuffer(bytes(nl.hiz), dtype=np.uint8)
+        self._pin_value = np.repeat(value[:, None], n, axis=1)
+        self._pin_drive = np.repeat(drive[:, None], n, axis=1)
+        self._pin_out = np.repeat((value & drive)[:, None], n, axis=1)
+        self._resolve()
+
+        self._sigs = {}
+        self._components = {}
+        for c in nl.components:
+            impl = _implementation(c)
+            if impl is None:
+                raise Exception(
+                    f"No batched implementation of {type(c).__name__} ({c.name()})"
+                )
+            self._components[c] = impl(self, c)
+        # (input pin ids, ids of the pins whose edges are sampled, batched
+        # component) for everything that can be woken.
+        self._wake = []
+        for c, b in self._components.items():
+            pins = self._inputs(c)
+            if pins:
+                sampled = self._inputs(c, sampled=True)
+                self._wake.append(
+                    (np.array(pins), np.array(sampled, dtype=np.int64), b)
+                )
+        # Whether components are being updated to see sampled edges.
+        self._sampling = False
+        self._clock = self._components[clock]
+
+    # The batched implementation of a component, e.g. `bs[ram].ram`.
+    def __getitem__(self, component):
+        return self._components[component]
+
+    # Pin ids of the component's NotifySignals, or with `sampled`, only those whose
+    # handlers sample the other inputs (see Scheduler.component_changed).
+    def _inputs(self, component, sampled=False):
+        return [
+            i
+            for s in component.__dict__.values()
+            if getattr(s, "_wake", 0) and (s._samples or not sampled)
+            for i in s._ids
+        ]
+
+    # (pin rows, bit weights) for a signal.
+    def _signal(self, signal):
+        s = self._sigs.get(signal)
+        if s is None:
+            # A signal's pins have contiguous ids.
+            rows = slice(signal._ids[0], signal._ids[0] + len(signal))
+            weights = np.left_shift(1, np.arange(len(signal), dtype=np.int64))
+            s = self._sigs[signal] = (rows, weights)
+        return s
+
+    # Current value of a signal in every instance.
+    def value(self, signal):
+        rows, weights = self._signal(signal)
+        return weights @ self._pin_value[rows]
+
+    # Driving pins read their own value straight away. A released pin keeps its
+    # last value until something else drives the net.
+    def _drive(self, signal, v, enable):
+        rows, weights = self._signal(signal)
+        enable = np.broadcast_to(np.asarray(enable, dtype=np.uint8), (self.n,))
+        bits = ((np.asarray(v, dtype=np.int64) & weights[:, None]) != 0).astype(
+            np.uint8
+        )
+        self._pin_drive[rows] = enable
+        self._pin_out[rows] = bits & enable
+        self._pin_value[rows] = np.where(enable, bits, self._pin_value[rows])
+
+    # Propagate every driven net to its hi-z pins, returning which pins changed
+    # value in any instance.
+    def _resolve(self):
+        driven = self._pin_drive[self._first]
+        out = self._pin_out[self._first]
+        for nets, pins in self._rank:
+            driven[nets] |= self._pin_drive[pins]
+            out[nets] |= self._pin_out[pins]
+        if len(self._pulled):
+            free = driven[self._pulled] == 0
+            out[self._pulled] = np.where(free, self._pull, out[self._pulled])
+            driven[self._pulled] |= free
+        pin_net = self._pin_net
+        follow = driven[pin_net] & (self._pin_drive ^ 1)
+        value = np.where(follow, out[pin_net], self._pin_value)
+        changed = (value != self._pin_value).any(axis=1)
+        self._pin_value = value
+        return changed
+
+    # Like Scheduler.settle, components are updated whenever their inputs change,
+    # and those that saw an edge that samples their other inputs are updated again
+    # to act on it once nothing else changes.
+    def settle(self):
+        sampling = {}
+        for _ in range(self.max_deltas):
+            changed = self._resolve()
+            woken = []
+            for pins, sampled, b in self._wake:
+                if changed[pins].any():
+                    woken.append(b)
+                    if changed[sampled].any():
+                        sampling[b] = True
+            if not woken:
+                if not sampling:
+                    return
+                woken = sampling
+                sampling = {}
+                self._sampling = True
+            self.deltas += 1
+            try:
+                for b in woken:
+                    b.update()
+            finally:
+                self._sampling = False
+        raise Exception(f"Batched simulation didn't settle in {self.max_deltas} deltas")
+
+    # Advance the clock of every active instance.
+    def tick(self):
+        self._clock.advance(self.active)
+        self.settle()
+        self.cycles += self.active
+
+    # Stop the instances where mask is set. They keep their state, but their clock
+    # no longer advances.
+    def halt(self, mask):
+        self.active &= ~np.asarray(mask, dtype=bool)
+
+    # Tick until every instance has halted (or `ticks` have run). `until` is called
+    # after each tick with this object, and returns a mask of instances to halt.
+    def run(self, ticks=None, until=None):
+        n = 0
+        while self.active.any() and (ticks is None or n < ticks):
+            self.tick()
+            n += 1
+            if until is not None:
+                self.halt(until(self))
+        return n
+
+
+@batched(Clock)
+class BatchedClock(BatchedComponent):
+    def __init__(self, bs, clock):
+        super().__init__(bs, clock)
+        self.v = np.full(bs.n, clock.value, dtype=np.int64)
+
+    def advance(self, active):
+        m = 1 << len(self.component.clk)
+        self.v = np.where(active, (self.v + 1) % m, self.v)
+        self.drive(self.component.clk, self.v)
+
+
+@batched(Power)
+class BatchedPower(BatchedComponent):
+    pass
+
+
+@batched(Counter)
+class BatchedCounter(BatchedComponent):
+    def __init__(self, bs, counter):
+        super().__init__(bs, counter)
+        self.v = np.full(bs.n, counter.v, dtype=np.int64)
+
+    def update(self):
+        c = self.component
+        e = self.had_edge(c.clk, 0, 1)
+        self.v = np.where(e, (self.v + 1) % (1 << len(c.out)), self.v)
+        self.drive(c.out, self.v)
+
+
+@batched(Register)
+class BatchedRegister(BatchedComponent):
+    def __init__(self, bs, reg):
+        super().__init__(bs, reg)
+        self.v = np.full(bs.n, reg.v, dtype=np.int64)
+
+    def update(self):
+        c = self.component
+        e = self.had_edge(c.we, 0, 1)
+        self.v = np.where(e, self.value(c.data), self.v)
+        self.drive(c.state, self.v)
+        self.drive(c.data, self.v, self.value(c.oe))
+
+
+@batched(IORegister)
+class BatchedIORegister(BatchedComponent):
+    def __init__(self, bs, reg):
+        super().__init__(bs, reg)
+        self.v = np.full(bs.n, reg.v, dtype=np.int64)
+
+    def update(self):
+        c = self.component
+        e = self.had_edge(c.we, 0, 1)
+        self.v = np.where(e, self.value(c.inp), self.v)
+        self.output()
+
+    def output(self):
+        c = self.component
+        self.drive(c.state, self.v)
+        self.drive(c.out, self.v, self.value(c.oe))
+
+
+@batched(IncRegister)
+class BatchedIncRegister(BatchedIORegister):
+    def update(self):
+        c = self.component
+        e = self.had_edge(c.inc, 0, 1)
+        self.v = np.where(e, (self.v + 1) & ((1 << len(c.inp)) - 1), self.v)
+        super().update()
+
+    def output(self):
+        super().output()
+        c = self.component
+        self.drive(c.carry, (self.v == 0) & (self.value(c.inc) == 1))
+
+
+@batched(SplitRegister)
+class BatchedSplitRegister(BatchedComponent):
+    def __init__(self, bs, reg):
+        super().__init__(bs, reg)
+        self.v = np.full(bs.n, reg.v, dtype=np.int64)
+
+    def update(self):
+        c = self.component
+        load_width = len(c.data) // len(c.we)
+        mask = (1 << load_width) - 1
+        for i in range(len(c.we)):
+            e = self.had_edge(c.we, i, 1)
+            self.v = np.where(e, (self.v & ~mask) | (self.value(c.data) & mask), self.v)
+            mask <<= load_width
+        self.drive(c.state, self.v)
+        self.drive(c.data, self.v, self.value(c.oe))
+
+
+@batched(BusConnect)
+class BatchedBusConnect(BatchedComponent):
+    def update(self):
+        c = self.component
+        self.drive(c.b, self.value(c.a), self.value(c.a_to_b))
+        self.drive(c.a, self.value(c.b), self.value(c.b_to_a))
+
+
+@batched(Multiplexer)
+class BatchedMultiplexer(BatchedComponent):
+    def update(self):
+        c = self.component
+        sel = self.value(c.sel)
+        self.drive(c.out, np.where(sel == 0, self.value(c.a), self.value(c.b)))
+
+
+@batched(Adder)
+class BatchedAdder(BatchedComponent):
+    def update(self):
+        c = self.component
+        out = self.value(c.a) + self.value(c.b)
+        self.drive(c.c, out >> len(c.a))
+        self.drive(c.out, out)
+
+
+# The ROM is the same in every instance.
+@batched(Rom)
+class BatchedRom(BatchedComponent):
+    def __init__(self, bs, rom):
+        super().__init__(bs, rom)
+        self.rom = np.array(rom.rom, dtype=_dtype(len(rom.data)))
+
+    def update(self):
+        c = self.component
+        self.drive(c.data, self.rom[self.value(c.addr)], self.value(c.oe))
+
+
+# `ram` has a row per instance, initially all a copy of the scalar Ram (or any
+# subclass's storage, e.g. SparseRam's pages).
+@batched(Ram)
+class BatchedRam(BatchedComponent):
+    def __init__(self, bs, ram):
+        super().__init__(bs, ram)
+        self.ram = np.tile(np.array(ram.dump(), dtype=_dtype(len(ram.data))), (bs.n, 1))
+
+    def update(self):
+        c = self.component
+        addr = self.value(c.addr)
+        w = np.flatnonzero(self.had_edge(c.we, 0, 1))
+        self.ram[w, addr[w]] = self.value(c.data)[w]
+        # Like Ram.output, the data pins are set to zero before being released.
+        oe = self.value(c.oe)
+        v = np.where(oe, self.ram[np.arange(self.bs.n), addr], 0)
+        self.drive(c.data, v)
+        self.drive(c.data, v, oe)
+
+
+@batched(PagedRamController)
+class BatchedPagedRamController(BatchedComponent):
+    def __init__(self, bs, ctrl):
+        super().__init__(bs, ctrl)
+        self.pages = np.tile(np.array(ctrl.pages, dtype=np.int64), (bs.n, 1))
+
+    def update(self):
+        c = self.component
+        in_addr = self.value(c.in_addr)
+        page = in_addr - c.reg_base_addr
+        w = np.flatnonzero(
+            self.had_edge(c.we, 0, 1) & (page >= 0) & (page < c.num_pages)
+        )
+        self.pages[w, page[w]] = self.value(c.data)[w]
+        v = self.pages[np.arange(self.bs.n), in_addr >> (c.addr_width - c.page_width)]
+        self.drive(c.out_addr, v)
+        self.drive(c.z, v == 0)
+
+
+# Like MemoryDevice, but on_write is given a mask of the instances that wrote and
+# on_read returns an array.
+class BatchedMemoryDevice(BatchedComponent):
+    def on_write(self, mask, offset, v):
+        pass
+
+    def on_read(self, offset):
+        return 0
+
+    def update(self):
+        c = self.component
+        offset = self.value(c.addr) - c.base_addr
+        sel = (offset >= 0) & (offset < c.size)
+        oe = self.value(c.oe)
+        self.drive(c.oe_out, np.where(sel, 0, oe))
+        self.drive(c.we_out, np.where(sel, 0, self.value(c.we)))
+        w = sel & self.had_edge(c.we, 0, 1)
+        if w.any():
+            self.on_write(w, offset, self.value(c.data))
+        self.drive(c.data, self.on_read(offset), sel & (oe != 0))
+
+
+# Instead of printing, each instance's output is collected in `output`.
+@batched(MemDisplay)
+class BatchedMemDisplay(BatchedMemoryDevice):
+    def __init__(self, bs, display):
+        super().__init__(bs, display)
+        self.v = np.full(bs.n, display.v, dtype=np.int64)
+        self.trigger = np.full(bs.n, display.trigger, dtype=np.int64)
+        self.output = [[] for _ in range(bs.n)]
+
+    def on_read(self, offset):
+        return np.where(offset == 0, self.v, np.where(offset == 1, self.trigger, 0))
+
+    def on_write(self, mask, offset, v):
+        self.v = np.where(mask & (offset == 0), v, self.v)
+        t = mask & (offset == 1) & (v != self.trigger)
+        self.trigger = np.where(t, v, self.trigger)
+        for i in np.flatnonzero(t):
+            self.output[i].append(int(self.v[i]))
+
+
+# Draws from the BatchSimulation's generator (see its `seed`), so each instance
+# gets a different sequence. Halted instances keep their last value.
+@batched(RNG)
+class BatchedRNG(BatchedMemoryDevice):
+    def __init__(self, bs, rng):
+        super().__init__(bs, rng)
+        self.v = np.zeros(bs.n, dtype=np.int64)
+
+    def on_read(self, offset):
+        new = self.bs.rng.integers(0, 256, self.bs.n)
+        self.v = np.where(self.bs.active, new, self.v)
+        return self.v
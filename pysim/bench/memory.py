@@ -0,0 +1,173 @@
+# Reports the memory used per pin by a generated wide design, and per word by the
+# Ram storage compared with the list of ints it used to be.
+# Run from the pysim directory: PYTHONPATH=. python3 bench/memory.py [registers] [width]
+# With `--against REV`, the same design is also built with sim.py from git revision
+# REV (e.g. the commit before a change, or the original simulator) in a separate
+# process, for a before/after comparison.
+
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from sim import *
+
+
+# Current resident set size in bytes (Linux only).
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+# Builds n registers on a bus, and returns (what to keep alive, number of pins,
+# number of nets).
+def build(n, width):
+    with Simulation() as sim:
+        bus = Register("bus", width)
+        regs = [Register(f"r{i}", width) for i in range(n)]
+        for r in regs:
+            bus.data += r.data
+        freeze()
+    return sim, len(sim.netlist.pins), len(sim.nets)
+
+
+# As build(), with a sim.py from before Simulation and freeze() (e.g. the original
+# simulator), which keeps every net in a module-level list and pins as objects.
+def build_legacy(n, width):
+    del all_nets[:]
+    bus = Register("bus", width)
+    regs = [Register(f"r{i}", width) for i in range(n)]
+    for r in regs:
+        bus.data += r.data
+    pins = [
+        p
+        for c in [bus] + regs
+        for s in vars(c).values()
+        if isinstance(s, Signal)
+        for p in s._pins
+    ]
+    nets = {id(p._net) for p in pins if p._net is not None}
+    return (bus, regs), len(pins), len(nets)
+
+
+if "Simulation" not in globals():
+    build = build_legacy
+
+
+def measure(n, width):
+    # Measure RSS and Python allocations in separate builds, as tracemalloc's own
+    # bookkeeping would otherwise show up in the RSS.
+    gc.collect()
+    rss0 = rss()
+    design, pins, nets = build(n, width)
+    rss1 = rss()
+    del design
+    gc.collect()
+
+    tracemalloc.start()
+    design, _, _ = build(n, width)
+    used, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "pins": pins,
+        "nets": nets,
+        "used": used,
+        "peak": peak,
+        "rss": rss1 - rss0,
+    }
+
+
+# Bytes allocated by make().
+def allocated(make):
+    gc.collect()
+    tracemalloc.start()
+    obj = make()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return used
+
+
+# Runs this script with sim.py from git revision `rev` and returns its measure().
+def measure_revision(rev, n, width):
+    here = os.path.dirname(os.path.abspath(__file__))
+    show = subprocess.run(
+        ["git", "show", f"{rev}:./sim.py"],
+        cwd=os.path.dirname(here),
+        capture_output=True,
+    )
+    if show.returncode:
+        raise Exception(f"No sim.py at {rev}: {show.stderr.decode().strip()}")
+    source = show.stdout
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "sim.py"), "wb") as f:
+            f.write(source)
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), str(n), str(width), "--json"],
+            env=dict(os.environ, PYTHONPATH=tmp),
+            capture_output=True,
+            text=True,
+        )
+    if result.returncode:
+        error = result.stderr.strip().splitlines()[-1:]
+        raise Exception(f"Can't build the design with sim.py from {rev}: {error}")
+    return json.loads(result.stdout)
+
+
+def report(label, m):
+    pins = m["pins"]
+    print(
+        f"{label:<8} allocated {m['used'] / pins:>4.0f} bytes/pin ({m['used'] / 1024 / 1024:.1f} MiB), "
+        f"peak {m['peak'] / pins:>4.0f} bytes/pin, rss {m['rss'] / pins:>4.0f} bytes/pin"
+    )
+
+
+def main():
+    args = sys.argv[1:]
+    rev = None
+    if "--against" in args:
+        k = args.index("--against")
+        rev = args[k + 1]
+        del args[k : k + 2]
+    args = [a for a in args if not a.startswith("--")]
+    n = int(args[0]) if len(args) > 0 else 2000
+    width = int(args[1]) if len(args) > 1 else 32
+
+    m = measure(n, width)
+    if "--json" in sys.argv:
+        print(json.dumps(m))
+        return
+
+    print(f"{n + 1} registers x {width} bits: {m['pins']} pins, {m['nets']} nets")
+    if rev is not None:
+        report(rev[:8], measure_revision(rev, n, width))
+        report("current", m)
+    else:
+        report("", m)
+
+    # Ram storage for an 18-bit address space (as cpu_ax_13), with one page used.
+    addr_width = 18
+    words = 2 ** addr_width
+
+    def sparse():
+        ram = SparseRam(addr_width)
+        ram.load(bytes(range(256)) * 16)
+        return ram
+
+    with Simulation():
+        for label, make in (
+            ("list", lambda: [0] * words),
+            ("Ram", lambda: Ram(addr_width)),
+            ("SparseRam", sparse),
+        ):
+            used = allocated(make)
+            print(
+                f"{label:<9} {used / words:>6.3f} bytes/word ({used / 1024:.0f} KiB for 2^{addr_width} words)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Exhaustively checks a gate-level version of the cpu_ax_13 ALU datapath (nor/add of
+# a 9-bit accumulator with an 8-bit operand) against its behaviour, using the packed
+# bit-parallel evaluator, and compares that with the same gates in the event-driven
+# simulator (the baseline), which is timed on a sample of the vectors, or on all of
+# them with --full.
+# Run from the pysim directory: PYTHONPATH=. python3 bench/packed.py [lanes] [--full]
+
+import sys
+import time
+
+from gates import And, Mux, Nor, Or, PackedCircuit, Xor
+from sim import *
+
+
+def alu_reference(a, b, fn):
+    if fn:
+        return {"out": ((a & 0xFF) + b) & 0x1FF}
+    else:
+        return {"out": (a & 0x100) | (~((a & 0xFF) | b) & 0xFF)}
+
+
+def build():
+    with Simulation() as sim:
+        src = Component("src")
+        a = Signal(src, "a", 9)
+        b = Signal(src, "b", 8)
+        fn = Signal(src, "fn", 1)
+        dst = Component("dst")
+        out = Signal(dst, "out", 9)
+
+        carry = None
+        for i in range(8):
+            # Full adder.
+            x1 = Xor(f"x1_{i}")
+            x1.inp[0] += a[i]
+            x1.inp[1] += b[i]
+            if carry is None:
+                s = x1.out
+                c = And(f"c_{i}")
+                c.inp[0] += a[i]
+                c.inp[1] += b[i]
+                carry = c.out
+            else:
+                x2 = Xor(f"x2_{i}")
+                x2.inp[0] += x1.out
+                x2.inp[1] += carry
+                s = x2.out
+                a1 = And(f"a1_{i}")
+                a1.inp[0] += a[i]
+                a1.inp[1] += b[i]
+                a2 = And(f"a2_{i}")
+                a2.inp[0] += x1.out
+                a2.inp[1] += carry
+                c = Or(f"c_{i}")
+                c.inp[0] += a1.out
+                c.inp[1] += a2.out
+                carry = c.out
+
+            nor = Nor(f"nor_{i}")
+            nor.inp[0] += a[i]
+            nor.inp[1] += b[i]
+
+            m = Mux(f"m_{i}")
+            m.a += nor.out
+            m.b += s
+            m.sel += fn
+            out[i] += m.out
+
+        m = Mux("m_8")
+        m.a += a[8]
+        m.b += carry
+        m.sel += fn
+        out[8] += m.out
+
+        freeze()
+        for c in sim.netlist.components:
+            c.reset()
+    return sim, a, b, fn, out
+
+
+def main():
+    positional = [a for a in sys.argv[1:] if not a.startswith("--")]
+    lanes = int(positional[0]) if positional else 64
+
+    sim, a, b, fn, out = build()
+    gates = len(sim.netlist.components) - 2
+    pc = PackedCircuit([a, b, fn], [out], lanes=lanes)
+    t = time.process_time()
+    failures = pc.exhaustive(alu_reference)
+    packed = time.process_time() - t
+    n = 1 << (len(a) + len(b) + len(fn))
+    print(f"{gates} gates, {n} vectors: {pc.evaluations} evaluations of {lanes} lanes")
+    print(f"packed:       {packed:.2f}s, {len(failures)} failures")
+    for args, got, expected in failures[:10]:
+        print(f"  {args}: {got} != {expected}")
+
+    # The same circuit in the event-driven simulator, on a sample of the vectors (or
+    # all of them with --full).
+    sample = n if "--full" in sys.argv else 4096
+    t = time.process_time()
+    bad = 0
+    with sim:
+        for v in range(0, n, n // sample):
+            args = {"a": v & 0x1FF, "b": (v >> 9) & 0xFF, "fn": v >> 17}
+            with batch():
+                a <<= args["a"]
+                b <<= args["b"]
+                fn <<= args["fn"]
+            if out.value() != alu_reference(**args)["out"]:
+                bad += 1
+    event = (time.process_time() - t) * n / sample
+    estimated = " (estimated)" if sample < n else ""
+    print(f"event-driven: {event:.2f}s{estimated}, {bad} failures in {sample}")
+    print(f"speedup:      {event / packed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
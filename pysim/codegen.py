@@ -0,0 +1,419 @@
+import hashlib
+import importlib.util
+import inspect
+import os
+import sys
+
+from sim import Bus, SignalView, int_to_bits
+
+# Generates a Python module specialized to one frozen netlist. This only covers net
+# resolution and signal drives: it isn't a compiler for the whole circuit.
+#
+# Every net gets its own update function with the pin ids, signals and components
+# to notify baked in as constants, and every signal gets a drive function that
+# writes its pins (or whole bus segments) directly rather than going through
+# SignalView and Pin. The scheduler calls these instead of Net.update and
+# SignalView.__ilshift__ while the netlist stays frozen. Component update() bodies
+# are arbitrary Python, so they aren't inlined: the scheduler still decides which
+# components to run and calls their update() methods as usual, and the clock is
+# still ticked with Clock.tick() (whose drive goes through the generated code).
+#
+# The generated module is cached on disk, keyed by a hash of the netlist structure
+# and the source of sim.py, this file, and every component class in the design.
+
+# Bump to invalidate cached modules when the generated code changes shape.
+_VERSION = 2
+
+
+def _cache_dir():
+    return os.environ.get(
+        "PYSIM_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "pysim")
+    )
+
+
+# Signals in pin id order (each signal's pins are contiguous).
+def _signals(nl):
+    return [s for i, s in enumerate(nl.pin_signal) if i == s._ids[0]]
+
+
+# Everything about the netlist that the generated code depends on.
+def _describe(nl, signals):
+    sig_index = {s: k for k, s in enumerate(signals)}
+    bus_index = {b: k for k, b in enumerate(nl.buses)}
+    nets = []
+    for n, ids in zip(nl.nets, nl.net_pins):
+        pins = tuple(
+            (i, sig_index[nl.pin_signal[i]], nl.pin_signal[i]._wake) for i in ids
+        )
+        nets.append((n._pull, bus_index.get(n._target, -1), pins))
+    buses = []
+    for b in nl.buses:
+        members = tuple(
+            (a, sig_index[s], s._wake) for a, s in zip(b._starts, b._signals)
+        )
+        buses.append((b._width, members))
+    sigs = []
+    for s in signals:
+        segments = s._view._segments
+        if segments is not None:
+            segments = tuple(
+                (lo, w, a, bus_index[b] if b else -1) for lo, w, a, b in segments
+            )
+        sigs.append((tuple(s._ids), tuple(nl.pin_net[i] for i in s._ids), segments))
+    return (_VERSION, tuple(nets), tuple(buses), tuple(sigs))
+
+
+# Hashes the description along with the source files that define sim, this module
+# and every component class (and its bases) in the design.
+def _source_hash(nl, description):
+    h = hashlib.sha256()
+    h.update(repr(description).encode())
+    files = {sys.modules[Bus.__module__].__file__, __file__}
+    for cls in {type(c) for c in nl.components}:
+        for base in cls.__mro__:
+            h.update(f"{base.__module__}.{base.__qualname__}".encode())
+            try:
+                files.add(inspect.getsourcefile(base))
+            except (OSError, TypeError):
+                # Built-in (e.g. object), or defined somewhere without a file.
+                pass
+    for path in sorted(f for f in files if f):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:20]
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+        self.indent = 0
+
+    def __call__(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def source(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def _notify(w, wake, k):
+    if wake == 3:
+        w(f"changed(T{k}, S{k})")
+    elif wake == 2:
+        w(f"if v:")
+        w(f"    changed(T{k}, S{k})")
+    elif wake == 1:
+        w(f"if not v:")
+        w(f"    changed(T{k}, S{k})")
+
+
+def _gen_net(w, n, net):
+    pull, bus, pins = net
+    sigs = sorted({k for _, k, wake in pins})
+    args = "".join(f", S{k}=signals[{k}], T{k}=signals[{k}]._target" for k in sigs)
+    w(
+        f"def net_{n}(n=nets[{n}], value=value, hiz=hiz, edge=edge, sched=sched, changed=changed, released=released{args}):"
+    )
+    w.indent += 1
+    w("ds = n._drivers")
+    w("if ds:")
+    w("    v = value[next(reversed(ds))]")
+    w("else:")
+    w("    return" if pull is None else f"    v = {pull}")
+    w("sched.net_updates += 1")
+    w("if v == n._value:")
+    w("    released(n, v)")
+    w("    return")
+    w("n._value = v")
+    w("n._released = []")
+    for i, k, wake in pins:
+        w(f"if hiz[{i}] and value[{i}] != v:")
+        w.indent += 1
+        w(f"value[{i}] = v")
+        w(f"edge[{i}] = v")
+        w(f"S{k}._cached = None")
+        _notify(w, wake, k)
+        w.indent -= 1
+    w.indent -= 1
+    w(f"updates[nets[{n}]] = net_{n}")
+
+
+def _gen_bus(w, b, bus):
+    width, members = bus
+    sigs = sorted({k for _, k, wake in members})
+    args = "".join(f", S{k}=signals[{k}], T{k}=signals[{k}]._target" for k in sigs)
+    w(
+        f"def bus_{b}(bus=buses[{b}], drivers=buses[{b}]._nets[0]._drivers, value=value, hiz=hiz, edge=edge, sched=sched, changed=changed, bus_released=bus_released{args}):"
+    )
+    w.indent += 1
+    # As Bus.update, which also handles partly driven members.
+    w(f"full = [a for a in drivers if hiz.find(1, a, a + {width}) < 0]")
+    w(f"if bus._driven != {width} * len(full):")
+    w("    return bus.update()")
+    w("if not full:")
+    w("    return")
+    w("sched.net_updates += 1")
+    w("d = full[-1]")
+    w(f"bits = value[d : d + {width}]")
+    w("if bits == bus._bits:")
+    w("    bus_released(bus, bits)")
+    w("    return")
+    w("bus._bits = bits")
+    w("bus._released = []")
+    for a, k, wake in members:
+        w(f"if hiz[{a}]:")
+        w.indent += 1
+        w(f"old = value[{a} : {a + width}]")
+        w("if old != bits:")
+        w.indent += 1
+        w(f"value[{a} : {a + width}] = bits")
+        w(f"S{k}._cached = None")
+        if wake in (1, 2):
+            w("woken = False")
+        for j in range(width):
+            w(f"if old[{j}] != bits[{j}]:")
+            w(f"    edge[{a + j}] = bits[{j}]")
+            if wake == 2:
+                w(f"    woken = woken or bits[{j}]")
+            elif wake == 1:
+                w(f"    woken = woken or not bits[{j}]")
+        if wake == 3:
+            w(f"changed(T{k}, S{k})")
+        elif wake:
+            w("if woken:")
+            w(f"    changed(T{k}, S{k})")
+        w.indent -= 2
+    w.indent -= 1
+    w(f"updates[buses[{b}]] = bus_{b}")
+
+
+# Release/drive a single pin that isn't part of a bus segment, as Pin.__ilshift__.
+def _gen_pin(w, i, n, bus, lo, release):
+    if n < 0:
+        w(f"P{i} = pins[{i}]")
+        w(f"P{i} <<= None" if release else f"P{i} <<= v >> {lo} & 1")
+        return
+    t = f"buses[{bus}]" if bus >= 0 else f"nets[{n}]"
+    if release:
+        w(f"if not hiz[{i}]:")
+        w(f"    hiz[{i}] = 1")
+        w(f"    nets[{n}]._drivers.pop({i}, None)")
+        if bus >= 0:
+            w(f"    {t}._driven -= 1")
+            w(f"    {t}._bits = None")
+        else:
+            w(f"    nets[{n}]._released.append({i})")
+        w(f"    sched._nets[{t}] = None")
+        return
+    acquire = [
+        f"hiz[{i}] = 0",
+        f"nets[{n}]._drivers[{i}] = None",
+        f"sched.contention[nets[{n}]] = None",
+    ]
+    if bus >= 0:
+        acquire += [f"{t}._driven += 1", f"{t}._bits = None"]
+    w(f"b = v >> {lo} & 1")
+    w(f"if b != value[{i}]:")
+    w(f"    value[{i}] = b")
+    w(f"    sig._cached = None")
+    w(f"    if hiz[{i}]:")
+    for line in acquire:
+        w(f"        {line}")
+    w(f"    sched._nets[{t}] = None")
+    w(f"elif hiz[{i}]:")
+    for line in acquire:
+        w(f"    {line}")
+    w(f"    sched._nets[{t}] = None")
+
+
+# Release/drive a whole bus segment, as SignalView._drive_segments and
+# _set_segment_hiz. `nets` are the net ids of each bit and `m` is the segment's
+# member index in the bus.
+def _gen_segment(w, lo, width, a, bus, nets, m, release):
+    t = f"buses[{bus}]"
+    if release:
+        w(f"if hiz.find(0, {a}, {a + width}) >= 0:")
+        w.indent += 1
+        for j, n in enumerate(nets):
+            w(f"if not hiz[{a + j}]:")
+            w(f"    del nets[{n}]._drivers[{a + j}]")
+            w(f"    {t}._driven -= 1")
+        w(f"hiz[{a} : {a + width}] = {bytes([1]) * width!r}")
+        w(f"{t}._released.append({m})")
+        w(f"sched._nets[{t}] = None")
+        w.indent -= 1
+        return
+    w(f"bits = int_to_bits(v >> {lo} & {(1 << width) - 1}, {width})")
+    w(f"if value[{a} : {a + width}] != bits:")
+    w(f"    value[{a} : {a + width}] = bits")
+    w(f"    sig._cached = None")
+    w(f"elif hiz.find(1, {a}, {a + width}) < 0:")
+    w(f"    bits = None")
+    w(f"if bits is not None:")
+    w.indent += 1
+    w(f"if hiz.find(1, {a}, {a + width}) >= 0:")
+    w.indent += 1
+    w("contention = sched.contention")
+    for j, n in enumerate(nets):
+        w(f"if hiz[{a + j}]:")
+        w(f"    nets[{n}]._drivers[{a + j}] = None")
+        w(f"    contention[nets[{n}]] = None")
+        w(f"    {t}._driven += 1")
+    w(f"hiz[{a} : {a + width}] = {bytes(width)!r}")
+    w.indent -= 1
+    w(f"sched._nets[{t}] = None")
+    w.indent -= 1
+
+
+def _gen_signal(w, k, sig, nets, buses):
+    ids, pin_net, segments = sig
+    if segments is None:
+        segments = tuple((lo, 1, i, -1) for lo, i in enumerate(ids))
+    w(
+        f"def drive_{k}(v, sig=signals[{k}], view=signals[{k}]._view, nl=nl, sched=sched, value=value, hiz=hiz, nets=nets, buses=buses, pins=pins):"
+    )
+    w.indent += 1
+    # Outside of settle() (or after the netlist has changed), the generic path
+    # handles holding the scheduler and warnings.
+    w("if not sched._running or not nl.frozen:")
+    w("    return view_ilshift(view, v)")
+    for release in (True, False):
+        if release:
+            w("if v is None:")
+        else:
+            w("else:")
+        w.indent += 1
+        if not release:
+            w("v = int(v)")
+            w(f"if v < 0 or v >= {1 << len(ids)}:")
+            w("    return view_ilshift(view, v)")
+        for lo, width, a, bus in segments:
+            if bus < 0:
+                n = pin_net[lo]
+                _gen_pin(w, a, n, nets[n][1] if n >= 0 else -1, lo, release)
+            else:
+                m = [start for start, _, _ in buses[bus][1]].index(a)
+                bits = pin_net[lo : lo + width]
+                _gen_segment(w, lo, width, a, bus, bits, m, release)
+        w.indent -= 1
+    w.indent -= 1
+    w(f"drives[signals[{k}]] = drive_{k}")
+
+
+def _generate(description, key):
+    _, nets, buses, sigs = description
+    w = _Writer()
+    w(f"# Generated by pysim codegen for netlist {key}. Do not edit.")
+    w("")
+    w("")
+    w("def build(nl, sched, nets, buses, signals, int_to_bits, view_ilshift):")
+    w.indent += 1
+    w("value = nl.value")
+    w("hiz = nl.hiz")
+    w("edge = nl.edge")
+    w("pins = nl.pins")
+    w("changed = sched.component_changed")
+    w("updates = {}")
+    w("drives = {}")
+    w("")
+    # As in Net.update, when the net's value hasn't changed only the pins released
+    # since the last update can be out of date.
+    w(
+        "def released(n, v, value=value, hiz=hiz, edge=edge, pin_signal=nl.pin_signal, notify=nl.pin_notify[0], notify1=nl.pin_notify[1], changed=changed):"
+    )
+    w("    rel = n._released")
+    w("    n._released = []")
+    w("    if v:")
+    w("        notify = notify1")
+    w("    for i in rel:")
+    w("        if hiz[i] and value[i] != v:")
+    w("            value[i] = v")
+    w("            edge[i] = v")
+    w("            pin_signal[i]._cached = None")
+    w("            s = notify[i]")
+    w("            if s:")
+    w("                changed(s._target, s)")
+    w("")
+    # As the member loop in Bus.update, for the members released since the last
+    # update when the bus value hasn't changed.
+    w("def bus_released(bus, bits, value=value, hiz=hiz, edge=edge, changed=changed):")
+    w("    rel = bus._released")
+    w("    bus._released = []")
+    w("    width = len(bits)")
+    w("    for m in rel:")
+    w("        a = bus._starts[m]")
+    w("        if not hiz[a]:")
+    w("            continue")
+    w("        sig = bus._signals[m]")
+    w("        wake = bus._wake[m]")
+    w("        old = value[a : a + width]")
+    w("        if old == bits:")
+    w("            continue")
+    w("        value[a : a + width] = bits")
+    w("        sig._cached = None")
+    w("        woken = False")
+    w("        for k in range(width):")
+    w("            if old[k] != bits[k]:")
+    w("                edge[a + k] = bits[k]")
+    w("                woken = woken or wake >> bits[k] & 1")
+    w("        if woken:")
+    w("            changed(sig._target, sig)")
+    w("")
+    for b, bus in enumerate(buses):
+        _gen_bus(w, b, bus)
+        w("")
+    for n, net in enumerate(nets):
+        if net[1] >= 0:
+            # Member of a bus; the scheduler only ever updates the bus.
+            continue
+        _gen_net(w, n, net)
+        w("")
+    for k, sig in enumerate(sigs):
+        _gen_signal(w, k, sig, nets, buses)
+        w("")
+    w("return updates, drives")
+    w.indent -= 1
+    return w.source()
+
+
+def _load(path, key):
+    spec = importlib.util.spec_from_file_location(f"pysim_netlist_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Compiles the (settled) netlist that `clock` belongs to and installs the generated
+# functions in its scheduler. Returns the function to step the circuit with, which
+# is clock.tick itself, so overrides of tick() and halting checks around it behave
+# as in the generic path.
+# Connecting anything afterwards uninstalls the generated code, and it needs to be
+# compiled again.
+def compile_netlist(clock, cache_dir=None):
+    sim = clock._sim
+    sim.settle()
+    nl = sim.netlist
+    signals = _signals(nl)
+    description = _describe(nl, signals)
+    key = _source_hash(nl, description)
+
+    cache_dir = cache_dir or _cache_dir()
+    path = os.path.join(cache_dir, f"netlist_{key}.py")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(_generate(description, key))
+        os.replace(tmp, path)
+    module = _load(path, key)
+
+    updates, drives = module.build(
+        nl,
+        sim.scheduler,
+        nl.nets,
+        nl.buses,
+        signals,
+        int_to_bits,
+        SignalView.__ilshift__,
+    )
+    sim.scheduler.install(updates, drives)
+    return clock.tick
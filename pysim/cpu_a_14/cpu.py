@@ -3,7 +3,7 @@ from sim import (
     Component,
     Signal,
     NotifySignal,
-    Net,
+    simulation,
     Register,
     IORegister,
     IncRegister,
@@ -54,9 +54,12 @@ class AccumulatorRegister(IORegister):
         self.z = Signal(self, "z", 1)
         self.cc = NotifySignal(self, "cc", 1)
 
-    def update(self, signal):
-        super().update(signal)
+    def output(self):
+        super().output()
         self.z <<= 1 if self.v == 0 else 0
+
+    def update(self, signal):
+        self.output()
         if self.cc.had_edge(0, 1):
             self.v = self.v & 0xFF
 
@@ -282,7 +285,7 @@ def main():
     except KeyboardInterrupt:
         pass
 
-    print(f"Ran for {cycles} cycles and {Net.net_updates} net updates.")
+    print(f"Ran for {cycles} cycles and {simulation().net_updates} net updates.")
 
     ram.stdout()
 
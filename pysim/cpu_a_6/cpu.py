@@ -1,9 +1,15 @@
-import sys
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from sim import (
     Component,
     Signal,
     NotifySignal,
-    Net,
+    simulation,
     Register,
     SplitRegister,
     BusConnect,
@@ -13,6 +19,7 @@ from sim import (
     Power,
     MemDisplay,
 )
+from batchsim import BatchedComponent, BatchSimulation, batched
 from .asm import Assembler
 
 # Implements https://github.com/cpldcpu/MCPU
@@ -113,7 +120,93 @@ class Decoder(Component):
         self.we <<= 0 if (clk == 1 or self.states != 0b001) else 1
 
 
+@batched(Decoder)
+class BatchedDecoder(BatchedComponent):
+    def __init__(self, bs, dec):
+        super().__init__(bs, dec)
+        self.acc = np.full(bs.n, dec.acc, dtype=np.int64)
+        self.adreg = np.full(bs.n, dec.adreg, dtype=np.int64)
+        self.pc = np.full(bs.n, dec.pc, dtype=np.int64)
+        self.states = np.full(bs.n, dec.states, dtype=np.int64)
+
+    def update(self):
+        d = self.component
+        e = self.had_edge(d.clk, 0, 1)
+        if e.any():
+            data = self.value(d.data)
+            s = self.states
+            fetch = e & (s == 0b000)
+            pc = self.pc
+            self.pc = np.where(fetch, self.adreg + 1, pc)
+            self.adreg = np.where(e, np.where(s == 0b000, data, pc), self.adreg)
+
+            # ALU / Data Path
+            acc = self.acc
+            add = ((acc & 0xFF) + data) & 0x1FF
+            nor = (acc & 0b100000000) | ((~((acc & 0xFF) | data)) & 0xFF)
+            acc = np.where(s == 0b010, add, acc)
+            acc = np.where(s == 0b011, nor, acc)
+            acc = np.where(s == 0b101, acc & 0xFF, acc)
+            self.acc = np.where(e, acc, self.acc)
+
+            # State machine
+            jcc = ((data & 0b11000000) == 0b11000000) & (self.acc & 0b100000000 != 0)
+            nxt = np.where(jcc, 0b101, ~((data >> 6) & 0b11) & 0b11)
+            self.states = np.where(e, np.where(s != 0b000, 0b000, nxt), s)
+
+        clk = self.value(d.clk)
+        s = self.states
+        self.drive(d.addr, self.adreg & 0x3F)
+        self.drive(d.data, self.acc & 0xFF, s == 0b001)
+        self.drive(d.oe, ~((clk == 1) | (s == 0b001) | (s == 0b101)) & 1)
+        self.drive(d.we, ~((clk == 1) | (s != 0b001)) & 1)
+
+
+# Runs n copies of the loaded program in lockstep, halting each one when its
+# program counter stops changing.
+def run_batch(clk, dec, ram, out, n):
+    bs = BatchSimulation(clk, n)
+    d = bs[dec]
+    last_pc = d.pc.copy()
+    hlt = np.zeros(n, dtype=np.int64)
+
+    def halted(bs):
+        nonlocal last_pc
+        hlt[:] = np.where(d.pc == last_pc, hlt + 1, 0)
+        last_pc = d.pc.copy()
+        return hlt > 4
+
+    bs.run(until=halted)
+
+    for line in bs[out].output[0]:
+        print(line)
+    same = (
+        all(o == bs[out].output[0] for o in bs[out].output)
+        and (bs[ram].ram == bs[ram].ram[0]).all()
+    )
+    print(
+        f"Ran {n} instances for {bs.cycles.max()} cycles and {bs.deltas} deltas ({'identical' if same else 'different'} results)."
+    )
+
+    ram.load(bs[ram].ram[0])
+    ram.stdout()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a program on cpu_a_6.")
+    parser.add_argument("program", help="assembly source")
+    parser.add_argument(
+        "--batch",
+        type=int,
+        metavar="N",
+        help="run N copies of the program in lockstep (needs numpy)",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+
     dec = Decoder()
 
     ram = Ram(addr_width=6)
@@ -130,7 +223,7 @@ def main():
 
     n = 0
     with Assembler(ram.ram, 0) as asm:
-        if not asm.parse(sys.argv[1]):
+        if not asm.parse(args.program):
             return
         asm.hlt()
 
@@ -140,6 +233,10 @@ def main():
         c.info()
         c.reset()
 
+    if args.batch:
+        run_batch(clk, dec, ram, out, args.batch)
+        return
+
     last_pc = None
     cycles = 0
     hlt = 0
@@ -160,7 +257,7 @@ def main():
     except KeyboardInterrupt:
         pass
 
-    print(f"Ran for {cycles} cycles and {Net.net_updates} net updates.")
+    print(f"Ran for {cycles} cycles and {simulation().net_updates} net updates.")
 
     ram.stdout()
 
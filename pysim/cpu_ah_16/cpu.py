@@ -1,9 +1,9 @@
-import sys
+import argparse
 from sim import (
     Component,
     Signal,
     NotifySignal,
-    Net,
+    simulation,
     Register,
     SplitRegister,
     BusConnect,
@@ -11,6 +11,7 @@ from sim import (
     Ram,
     Rom,
     Power,
+    Profile,
 )
 from .asm import Assembler
 
@@ -124,8 +125,8 @@ class Logic(Component):
 class Decoder(Component):
     def __init__(self):
         super().__init__("decoder")
-        self.instr = Signal(self, "instr", 8)
-        self.flags = Signal(self, "flags", 4)
+        self.instr = NotifySignal(self, "instr", 8)
+        self.flags = NotifySignal(self, "flags", 4)
         self.clk = NotifySignal(self, "clk", 2)
 
         self.al_ie = Signal(self, "al_ie", 1)
@@ -354,6 +355,10 @@ class InstructionRegister(Component):
         self.we = NotifySignal(self, "we", 1)
         self.oe = NotifySignal(self, "oe", 1)
 
+    # instr only changes on a rising edge of we.
+    def combinational_paths(self):
+        return {self.instr: (), self.imm: (self.oe,)}
+
     def update(self, signal):
         if self.we.had_edge(0, 1):
             self.v = self.data.value()
@@ -392,7 +397,25 @@ class ProgramCounter(Component):
         self.addr <<= self.v
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a program on cpu_ah_16.")
+    parser.add_argument("program", help="assembly source")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print updates, time and drives per component once the program halts",
+    )
+    parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        help="write the same per-component profile to FILE as JSON",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+
     power = Power()
     logic = Logic()
     reg_a = SplitRegister("reg_a", load_width=4)
@@ -506,7 +529,7 @@ def main():
 
     n = 0
     with Assembler(rom.rom, 0) as a:
-        if not a.parse(sys.argv[1]):
+        if not a.parse(args.program):
             return
         a.hlt()
 
@@ -545,6 +568,12 @@ def main():
         c.info()
         c.reset()
 
+    # Count updates, time and drives per component while the program runs.
+    profile = None
+    if args.profile or args.profile_json:
+        profile = Profile(simulation())
+        profile.start()
+
     last_pc = None
     cycles = 0
 
@@ -568,7 +597,16 @@ def main():
     except KeyboardInterrupt:
         pass
 
-    print(f"Ran for {cycles} cycles and {Net.net_updates} net updates.")
+    print(f"Ran for {cycles} cycles and {simulation().net_updates} net updates.")
+
+    if profile:
+        profile.stop()
+        if args.profile:
+            print(profile.table(by="class"))
+            print(profile.table())
+        if args.profile_json:
+            with open(args.profile_json, "w") as f:
+                f.write(profile.json())
 
     print("RAM:")
     for i in range(0, 0x100, 16):
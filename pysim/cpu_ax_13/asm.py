@@ -1,6 +1,7 @@
 import collections
 import sys
 from lark import Lark, UnexpectedInput
+from sim import write_hex
 
 l = Lark(open("cpu_ax_13/asm.g").read(), parser="earley", lexer="auto")
 
@@ -456,17 +457,25 @@ class Assembler:
             return True
 
 
+# Assemble to an Intel HEX (.hex) or raw binary (.bin) image, or otherwise a
+# Python module for the programmer.
 def main():
-    ram = [0] * (2 ** 18)
+    ram = bytearray(2 ** 18)
     with Assembler(ram, 0) as asm:
         if not asm.parse(sys.argv[1]):
             sys.exit(1)
     n = len(ram) - 1
     while ram[n] == 0:
         n -= 1
-    with open(sys.argv[2], "w") as f:
-        print("DATA = " + repr(bytearray(ram[0 : n + 1])), file=f)
-        print("load(DATA)", file=f)
+    if sys.argv[2].endswith(".hex"):
+        write_hex(sys.argv[2], [(0, ram[0 : n + 1])])
+    elif sys.argv[2].endswith(".bin"):
+        with open(sys.argv[2], "wb") as f:
+            f.write(ram[0 : n + 1])
+    else:
+        with open(sys.argv[2], "w") as f:
+            print("DATA = " + repr(ram[0 : n + 1]), file=f)
+            print("load(DATA)", file=f)
 
 
 if __name__ == "__main__":
@@ -3,12 +3,12 @@ from sim import (
     Component,
     Signal,
     NotifySignal,
-    Net,
+    simulation,
     Register,
     SplitRegister,
     BusConnect,
     Clock,
-    Ram,
+    SparseRam,
     Rom,
     Power,
     MemDisplay,
@@ -155,7 +155,7 @@ class Decoder(Component):
 def main():
     dec = Decoder()
 
-    ram = Ram(addr_width=20)
+    ram = SparseRam(addr_width=20)
     paged_ram = PagedRamController(
         addr_width=13, num_pages=2, reg_base_addr=2 ** 12 - 7
     )
@@ -206,7 +206,7 @@ def main():
     except KeyboardInterrupt:
         pass
 
-    print(f"Ran for {cycles} cycles and {Net.net_updates} net updates.")
+    print(f"Ran for {cycles} cycles and {simulation().net_updates} net updates.")
 
     ram.stdout()
 
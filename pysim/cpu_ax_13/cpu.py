@@ -1,4 +1,5 @@
-import sys
+import argparse
+import contextlib
 from sim import (
     Component,
     Signal,
@@ -6,16 +7,17 @@ from sim import (
     IORegister,
     IncRegister,
     Clock,
-    Ram,
-    Net,
+    SparseRam,
+    simulation,
     MemDisplay,
     Multiplexer,
     PagedRamController,
-    debug,
-    trace,
-    warn,
+    Profile,
+    TRACE,
     RNG,
 )
+from codegen import compile_netlist
+from shared import SharedRam
 from .asm import Assembler
 
 
@@ -34,16 +36,19 @@ class ALU(Component):
         if self.we.had_edge(0, 1):
             if self.fn.value() == 0:
                 # nor
-                trace("alu nor {} {}".format(self.a.value(), self.b.value()), end="")
+                if self._log >= TRACE:
+                    self.trace("alu nor {} {}", self.a.value(), self.b.value(), end="")
                 carry = self.a.value() & 0b100000000
                 value = self.a.value() & 0xFF
                 self.v = carry | ((~(value | self.b.value())) & 0xFF)
             else:
                 # add
-                trace("alu add {} {}".format(self.a.value(), self.b.value()), end="")
+                if self._log >= TRACE:
+                    self.trace("alu add {} {}", self.a.value(), self.b.value(), end="")
                 self.v = ((self.a.value() & 0xFF) + self.b.value()) & 0x1FF
 
-            trace(" --> {}".format(self.v))
+            if self._log >= TRACE:
+                self.trace(" --> {}", self.v)
 
         if self.oe.value() == 1:
             self.out <<= self.v
@@ -57,9 +62,12 @@ class AccumulatorRegister(IORegister):
         self.z = Signal(self, "z", 1)
         self.cc = NotifySignal(self, "cc", 1)
 
-    def update(self, signal):
-        super().update(signal)
+    def output(self):
+        super().output()
         self.z <<= 1 if self.v == 0 else 0
+
+    def update(self, signal):
+        self.output()
         if self.cc.had_edge(0, 1):
             self.v = self.v & 0xFF
 
@@ -201,12 +209,60 @@ class RamIndex(Component):
             self.out <<= self.addr.value()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a program on cpu_ax_13.")
+    parser.add_argument(
+        "program", help="assembly source, or a .hex or .bin image to run as is"
+    )
+    parser.add_argument(
+        "--save-hex",
+        metavar="PATH",
+        help="write the initial RAM image to PATH as Intel HEX, e.g. to run it again "
+        "without assembling (ram.hex is no longer written by default)",
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="run the netlist through the code generator (see codegen.py)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="count updates per component and net while the program runs",
+    )
+    parser.add_argument(
+        "--diff", action="store_true", help="only show the RAM the program changed"
+    )
+    parser.add_argument(
+        "--shared",
+        metavar="NAME",
+        help="share RAM and registers with other processes, see shared.py",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    # Anything registered with `cleanup` (e.g. removing shared memory) happens even
+    # if the program fails to load or run.
+    with contextlib.ExitStack() as cleanup:
+        run(args, cleanup)
+
+
+def run(args, cleanup):
     dec = Decoder()
 
     clk = Clock(1)
 
-    ram = Ram(addr_width=18)
+    if args.shared:
+        ram = SharedRam(
+            addr_width=18,
+            values=("pc", "acc", "x", "ar", "ir"),
+            name=args.shared,
+        )
+        cleanup.callback(ram.close)
+    else:
+        ram = SparseRam(addr_width=18)
     paged_ram = PagedRamController(
         addr_width=13, num_pages=2, reg_base_addr=2 ** 12 - 7, data_width=6
     )
@@ -293,13 +349,20 @@ def main():
 
     print("Loading RAM...")
 
-    n = 0
-    with Assembler(ram.ram, 0) as asm:
-        if not asm.parse(sys.argv[1]):
-            return
+    # Start from a prebuilt image (e.g. one written with --save-hex) if given one.
+    if args.program.endswith(".hex"):
+        ram.load_hex(args.program)
+    elif args.program.endswith(".bin"):
+        ram.load_binary(args.program)
+    else:
+        with Assembler(ram.ram, 0) as asm:
+            if not asm.parse(args.program):
+                return
 
     ram.stdout()
-    ram.save("ram.hex")
+    if args.save_hex:
+        ram.save_hex(args.save_hex)
+    initial = ram.snapshot()
 
     for c in (
         dec,
@@ -321,15 +384,33 @@ def main():
         c.info()
         c.reset()
 
+    step = clk.tick
+    if args.compile:
+        step = compile_netlist(clk)
+
+    profile = None
+    if args.profile:
+        profile = Profile(simulation())
+        profile.start()
+
     last_pc = None
     cycles = 0
     hlt = 0
 
     try:
         while True:
-            clk.tick()
+            step()
 
             cycles += 1
+            if args.shared:
+                ram.shared.publish(
+                    cycles,
+                    pc=(pch.value() << 8) | pcl.value(),
+                    acc=acc.value(),
+                    x=x.value(),
+                    ar=ar.value(),
+                    ir=ir.value(),
+                )
 
             if dec.state == 0:
                 if pcl.value() == last_pc:
@@ -342,9 +423,14 @@ def main():
     except KeyboardInterrupt:
         pass
 
-    print(f"Ran for {cycles} cycles and {Net.net_updates} net updates.")
+    print(f"Ran for {cycles} cycles and {simulation().net_updates} net updates.")
 
-    ram.stdout()
+    if profile:
+        profile.stop()
+        print(profile.table(by="class"))
+        print(profile.net_table(limit=20))
+
+    ram.stdout(previous=initial if args.diff else None)
 
 
 if __name__ == "__main__":
@@ -3,7 +3,7 @@ from sim import (
     Component,
     Signal,
     NotifySignal,
-    Net,
+    simulation,
     Register,
     SplitRegister,
     BusConnect,
@@ -205,7 +205,7 @@ def main():
     except KeyboardInterrupt:
         pass
 
-    print(f"Ran for {cycles} cycles and {Net.net_updates} net updates.")
+    print(f"Ran for {cycles} cycles and {simulation().net_updates} net updates.")
 
     ram.stdout()
 
@@ -0,0 +1,27 @@
+from sim import *
+from gates import Not
+
+
+def main():
+    # Three inverters in a ring never settle.
+    gates = [Not("not{}".format(i)) for i in range(3)]
+    for a, b in zip(gates, gates[1:] + gates[:1]):
+        a.out += b.inp
+
+    # The loop can be found before running anything.
+    for components, nets in combinational_loops():
+        print("Loop:", ", ".join(c.name() for c in components))
+        for n in nets:
+            print("  via", n.name())
+
+    # Running it fails once settling takes more than 1000 delta cycles.
+    set_settle_budget(1000)
+    try:
+        for c in gates:
+            c.reset()
+    except Exception as e:
+        print(e)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import abc
+
+from sim import Component, NotifySignal, Signal
+
+# Gate-level primitives. Each gate is an ordinary Component, so gates can be wired
+# to each other and to behavioural components and simulated as normal. A circuit
+# made of gates can also be evaluated bit-parallel by PackedCircuit.
+#
+# Gates compute their output with `_eval(ins, mask)`, where `ins` has one integer
+# per input pin. In the normal simulation these are single bits and mask is 1; in
+# PackedCircuit each integer holds one bit per test vector and mask has a bit set
+# for every vector, so the same code evaluates all of them at once.
+
+
+# A combinational gate with a 1-bit output.
+class Gate(Component, metaclass=abc.ABCMeta):
+    def __init__(self, name):
+        super().__init__(name)
+        self.out = Signal(self, "out", 1)
+
+    # Input signals, in the order their pins are given to _eval.
+    def inputs(self):
+        return ()
+
+    @abc.abstractmethod
+    def _eval(self, ins, mask):
+        pass
+
+    def update(self, signal):
+        ins = []
+        for s in self.inputs():
+            v = s.value()
+            ins.extend((v >> i) & 1 for i in range(len(s)))
+        self.out <<= self._eval(ins, 1)
+
+    # Drive the output for the current inputs, which otherwise only happens once one
+    # of them changes.
+    def reset(self):
+        self.update(None)
+
+
+# A gate with n inputs, all in one signal.
+class LogicGate(Gate):
+    def __init__(self, name, n=2):
+        super().__init__(name)
+        self.inp = NotifySignal(self, "inp", n)
+
+    def inputs(self):
+        return (self.inp,)
+
+
+class And(LogicGate):
+    def _eval(self, ins, mask):
+        v = mask
+        for x in ins:
+            v &= x
+        return v
+
+
+class Or(LogicGate):
+    def _eval(self, ins, mask):
+        v = 0
+        for x in ins:
+            v |= x
+        return v
+
+
+class Nor(Or):
+    def _eval(self, ins, mask):
+        return super()._eval(ins, mask) ^ mask
+
+
+class Xor(LogicGate):
+    def _eval(self, ins, mask):
+        v = 0
+        for x in ins:
+            v ^= x
+        return v
+
+
+class Not(LogicGate):
+    def __init__(self, name):
+        super().__init__(name, 1)
+
+    def _eval(self, ins, mask):
+        return ins[0] ^ mask
+
+
+# out = a if sel is 0, otherwise b.
+class Mux(Gate):
+    def __init__(self, name):
+        super().__init__(name)
+        self.a = NotifySignal(self, "a", 1)
+        self.b = NotifySignal(self, "b", 1)
+        self.sel = NotifySignal(self, "sel", 1)
+
+    def inputs(self):
+        return (self.a, self.b, self.sel)
+
+    def _eval(self, ins, mask):
+        a, b, sel = ins
+        return (a & (sel ^ mask)) | (b & sel)
+
+
+# Drives out with a while en is high, otherwise releases it. Several can drive one
+# net; in PackedCircuit the net is the OR of the enabled ones.
+class TriState(Gate):
+    def __init__(self, name):
+        super().__init__(name)
+        self.a = NotifySignal(self, "a", 1)
+        self.en = NotifySignal(self, "en", 1)
+
+    def inputs(self):
+        return (self.a, self.en)
+
+    def _eval(self, ins, mask):
+        a, en = ins
+        return a & en
+
+    def update(self, signal):
+        self.out <<= self.a.value() if self.en.value() else None
+
+
+# Rising-edge D flip-flop. In PackedCircuit, q is state that's updated from d by
+# PackedCircuit.clock().
+class DFF(Component):
+    def __init__(self, name):
+        super().__init__(name)
+        self.d = Signal(self, "d", 1)
+        self.clk = NotifySignal(self, "clk", 1, trigger="rising", handler=self.on_clk)
+        self.q = Signal(self, "q", 1)
+        self.v = 0
+
+    def on_clk(self):
+        self.v = self.d.value()
+        self.q <<= self.v
+
+    def reset(self):
+        self.v = 0
+        self.q <<= self.v
+
+
+# Evaluates the gates between a set of input signals and output signals for many
+# input vectors at once. Each net's state is an integer with one bit per vector
+# (`lanes` of them), so one pass over the gates evaluates `lanes` vectors.
+# Components other than gates are ignored, so the inputs can belong to a harness
+# component (or the rest of a design) and are set directly.
+class PackedCircuit:
+    def __init__(self, inputs, outputs, lanes=64):
+        if lanes < 1 or lanes & (lanes - 1):
+            raise ValueError(f"Lanes must be a power of two: {lanes}")
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.lanes = lanes
+        self.mask = (1 << lanes) - 1
+        self.evaluations = 0
+
+        sim = self.inputs[0]._component._sim
+        nl = sim.netlist
+        if not nl.frozen:
+            sim.freeze()
+        self._pin_net = nl.pin_net
+
+        self._input_nets = [self._nets(s) for s in self.inputs]
+        self._output_nets = [self._nets(s) for s in self.outputs]
+
+        # Net -> gates driving it, and the (d, q) nets of every flip-flop.
+        drivers = {}
+        self._dffs = []
+        for c in nl.components:
+            if isinstance(c, Gate):
+                net = self._pin_net[c.out._ids[0]]
+                if net >= 0:
+                    drivers.setdefault(net, []).append(c)
+            elif isinstance(c, DFF):
+                self._dffs.append((self._nets(c.d)[0], self._nets(c.q)[0]))
+
+        # Find the gates that the outputs and flip-flops depend on.
+        ready = set(n for nets in self._input_nets for n in nets)
+        ready.update(q for _, q in self._dffs)
+        gates = {}
+        stack = [n for nets in self._output_nets for n in nets]
+        stack.extend(d for d, _ in self._dffs)
+        seen = set()
+        while stack:
+            net = stack.pop()
+            if net in seen or net in ready:
+                continue
+            seen.add(net)
+            if net not in drivers:
+                raise Exception(f"Undriven gate input: {nl.nets[net].name()}")
+            for g in drivers[net]:
+                ins = [n for s in g.inputs() for n in self._nets(s)]
+                gates[g] = (net, ins)
+                stack.extend(ins)
+
+        # Then order them so that every net is fully driven before it's read.
+        waiting = {}
+        readers = {}
+        pending = {}
+        for g, (net, ins) in gates.items():
+            waiting[g] = len(set(ins) - ready)
+            for n in set(ins):
+                readers.setdefault(n, []).append(g)
+            pending[net] = pending.get(net, 0) + 1
+        queue = [g for g, n in waiting.items() if not n]
+        self._ops = []
+        for g in queue:
+            net, ins = gates[g]
+            self._ops.append((net, g._eval, ins, len(drivers[net]) > 1))
+            pending[net] -= 1
+            if not pending[net]:
+                for r in readers.get(net, ()):
+                    waiting[r] -= 1
+                    if not waiting[r]:
+                        queue.append(r)
+        if len(self._ops) < len(gates):
+            loop = sorted(g.name() for g, n in waiting.items() if n)
+            raise Exception("Combinational loop through {}".format(", ".join(loop)))
+
+        self.state = {q: 0 for _, q in self._dffs}
+        self._words = {}
+
+    def _nets(self, signal):
+        nets = [self._pin_net[i] for i in signal._ids]
+        if -1 in nets:
+            raise Exception(f"Unconnected pin in {signal.name()}")
+        return nets
+
+    # Evaluate one batch. `words` maps each input signal to a list with one integer
+    # per pin (bit l of which is that pin's value in vector l), and the outputs are
+    # returned the same way.
+    def evaluate(self, words):
+        w = dict(self.state)
+        for s, nets in zip(self.inputs, self._input_nets):
+            w.update(zip(nets, words[s]))
+        mask = self.mask
+        for net, fn, ins, shared in self._ops:
+            v = fn([w[n] for n in ins], mask)
+            if shared:
+                v |= w.get(net, 0)
+            w[net] = v
+        self.evaluations += 1
+        self._words = w
+        return {
+            s: [w[n] for n in nets] for s, nets in zip(self.outputs, self._output_nets)
+        }
+
+    # Load every flip-flop from its d input, as of the last evaluate().
+    def clock(self):
+        self.state = {q: self._words.get(d, 0) for d, q in self._dffs}
+
+    # Evaluate a list of input vectors (dicts of signal -> int), returning a list
+    # of output dicts.
+    def run(self, vectors):
+        results = []
+        for k in range(0, len(vectors), self.lanes):
+            batch = vectors[k : k + self.lanes]
+            words = {}
+            for s in self.inputs:
+                pins = [0] * len(s)
+                for l, vec in enumerate(batch):
+                    v = vec[s]
+                    for i in range(len(s)):
+                        pins[i] |= ((v >> i) & 1) << l
+                words[s] = pins
+            out = self.evaluate(words)
+            values = [(s, _lanes(out[s], len(batch))) for s in self.outputs]
+            for l in range(len(batch)):
+                results.append({s: v[l] for s, v in values})
+        return results
+
+    # Evaluate every combination of input values and compare them against
+    # `reference`, which is called with the input values as keyword arguments
+    # (named after the signals) and returns a dict of output signal name -> value.
+    # Returns a list of (inputs, outputs, expected) for each mismatch.
+    def exhaustive(self, reference):
+        n = sum(len(s) for s in self.inputs)
+        # The low bits of the vector number are the lane, and the rest are the same
+        # for every lane in a batch.
+        lane_bits = min(self.lanes.bit_length() - 1, n)
+        lanes = 1 << lane_bits
+        patterns = [
+            sum(((l >> j) & 1) << l for l in range(lanes)) for j in range(lane_bits)
+        ]
+        names = [s._name for s in self.inputs]
+        if len(set(names)) < len(names):
+            raise ValueError(f"Input signal names must be unique: {names}")
+        fields = [(s._name, len(s), (1 << len(s)) - 1) for s in self.inputs]
+        failures = []
+        for batch in range(1 << (n - lane_bits)):
+            bits = patterns + [
+                self.mask if (batch >> j) & 1 else 0 for j in range(n - lane_bits)
+            ]
+            words = {}
+            k = 0
+            for s in self.inputs:
+                words[s] = bits[k : k + len(s)]
+                k += len(s)
+            out = self.evaluate(words)
+            values = [(s._name, _lanes(out[s], lanes)) for s in self.outputs]
+            for l in range(lanes):
+                vector = (batch << lane_bits) | l
+                args = {}
+                for name, width, mask in fields:
+                    args[name] = vector & mask
+                    vector >>= width
+                got = {name: v[l] for name, v in values}
+                expected = reference(**args)
+                if got != expected:
+                    failures.append((args, got, expected))
+        return failures
+
+
+# The value of a signal in each of the first n lanes, given its per-pin words.
+def _lanes(pins, n):
+    values = [0] * n
+    for i, w in enumerate(pins):
+        b = 1 << i
+        w &= (1 << n) - 1
+        while w:
+            low = w & -w
+            values[low.bit_length() - 1] |= b
+            w ^= low
+    return values
@@ -0,0 +1,214 @@
+import mmap
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from sim import Ram, copy_words, new_words
+
+# Shares the memory of a running simulation, along with its cycle count and a few
+# named values (e.g. registers), with other processes. The state lives in a
+# multiprocessing.shared_memory block (or an mmap'd file), so a reader such as a
+# visualiser can look at it whenever it likes without the simulation doing any
+# more than writing to its RAM as usual.
+#
+# Layout: a header, a table of named values, then the memory words (aligned to 64
+# bytes). All integers are little-endian. `seq` is incremented before and after
+# each publish(), so a reader that sees the same even value before and after
+# reading the values has a consistent set.
+
+_MAGIC = b"PSIM"
+_VERSION = 1
+# magic, version, word size, number of values, (padding), number of words, data
+# offset, seq, cycles
+_HEADER = struct.Struct("<4sHHI4xQQQQ")
+_SEQ = 32
+_CYCLES = 40
+# name, value
+_VALUE = struct.Struct("<16sQ")
+_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def _attach_shared_memory(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    shm = shared_memory.SharedMemory(name)
+    # Otherwise this process would remove the block when it exits, even though it
+    # didn't create it.
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class SharedState:
+    def __init__(self, buf, closer, unlink=None):
+        # The shared memory name or file path.
+        self.name = None
+        self._buf = memoryview(buf)
+        self._closer = closer
+        self._unlink = unlink
+        magic, version, size, n, words, offset, _, _ = _HEADER.unpack_from(self._buf)
+        if magic != _MAGIC or version != _VERSION:
+            raise Exception("Not a shared simulation state")
+        self._index = {}
+        for k in range(n):
+            name, _ = _VALUE.unpack_from(self._buf, _HEADER.size + k * _VALUE.size)
+            self._index[name.rstrip(b"\0").decode()] = (
+                _HEADER.size + k * _VALUE.size + 16
+            )
+        self.ram = self._buf[offset : offset + words * size].cast(_FORMATS[size])
+
+    # Create a new shared state with `words` words of data_width bits and the given
+    # value names, either as shared memory called `name` (or a generated name, see
+    # `self.name`) or in the file at `path`.
+    @classmethod
+    def create(cls, words, data_width=8, values=(), name=None, path=None):
+        size = new_words(1, data_width).itemsize if data_width > 8 else 1
+        offset = -(-(_HEADER.size + len(values) * _VALUE.size) // 64) * 64
+        total = offset + words * size
+        if path is not None:
+            with open(path, "w+b") as f:
+                f.truncate(total)
+                buf = mmap.mmap(f.fileno(), total)
+            closer = buf.close
+            unlink = lambda: os.remove(path)
+            shared_name = path
+        else:
+            shm = shared_memory.SharedMemory(name, create=True, size=total)
+            buf = shm.buf
+            closer = shm.close
+            unlink = shm.unlink
+            shared_name = shm.name
+        _HEADER.pack_into(
+            buf, 0, _MAGIC, _VERSION, size, len(values), words, offset, 0, 0
+        )
+        for k, v in enumerate(values):
+            if len(v.encode()) > 16:
+                raise ValueError(f"Value name too long: {v}")
+            _VALUE.pack_into(buf, _HEADER.size + k * _VALUE.size, v.encode(), 0)
+        state = cls(buf, closer, unlink)
+        state.name = shared_name
+        return state
+
+    # Open a shared state created by another process.
+    @classmethod
+    def attach(cls, name=None, path=None):
+        if path is not None:
+            with open(path, "r+b") as f:
+                buf = mmap.mmap(f.fileno(), 0)
+            state = cls(buf, buf.close)
+            state.name = path
+        else:
+            shm = _attach_shared_memory(name)
+            state = cls(shm.buf, shm.close)
+            state.name = name
+        return state
+
+    def names(self):
+        return list(self._index)
+
+    @property
+    def cycles(self):
+        return struct.unpack_from("<Q", self._buf, _CYCLES)[0]
+
+    # Update the cycle count and any of the named values.
+    def publish(self, cycles=None, **values):
+        buf = self._buf
+        seq = struct.unpack_from("<Q", buf, _SEQ)[0]
+        struct.pack_into("<Q", buf, _SEQ, seq + 1)
+        if cycles is not None:
+            struct.pack_into("<Q", buf, _CYCLES, cycles)
+        for k, v in values.items():
+            struct.pack_into("<Q", buf, self._index[k], v)
+        struct.pack_into("<Q", buf, _SEQ, seq + 2)
+
+    # A consistent (cycles, {name: value}) as of the last publish(). While the
+    # writer is part way through a publish, retry, yielding at first and then
+    # backing off, and give up after `timeout` seconds (e.g. if the writer died
+    # mid-publish).
+    def snapshot(self, timeout=1):
+        buf = self._buf
+        deadline = time.monotonic() + timeout
+        delay = 0
+        while True:
+            seq = struct.unpack_from("<Q", buf, _SEQ)[0]
+            if not seq & 1:
+                cycles = struct.unpack_from("<Q", buf, _CYCLES)[0]
+                values = {
+                    k: struct.unpack_from("<Q", buf, i)[0]
+                    for k, i in self._index.items()
+                }
+                if struct.unpack_from("<Q", buf, _SEQ)[0] == seq:
+                    return cycles, values
+            if time.monotonic() > deadline:
+                raise Exception(
+                    f"No consistent snapshot of {self.name} after {timeout}s, "
+                    "the writer may have stopped mid-publish"
+                )
+            time.sleep(delay)
+            delay = min(delay * 2 or 1e-5, 1e-3)
+
+    # Detach from the shared state, and remove it if `unlink` and this process
+    # created it.
+    def close(self, unlink=True):
+        self.ram.release()
+        self._buf.release()
+        self._closer()
+        if unlink and self._unlink:
+            self._unlink()
+
+
+# A Ram whose contents are in a SharedState (see `ram.shared`), so another process
+# can attach to it and read them while the simulation runs.
+class SharedRam(Ram):
+    def __init__(self, addr_width=16, data_width=8, values=(), name=None, path=None):
+        self._shared_args = (values, name, path)
+        self._data_width = data_width
+        super().__init__(addr_width, data_width)
+
+    def _storage(self, n, data_width):
+        values, name, path = self._shared_args
+        self.shared = SharedState.create(n, data_width, values, name, path)
+        return self.shared.ram
+
+    # Stop sharing. The contents are copied back into local memory, so the Ram keeps
+    # working.
+    def close(self, unlink=True):
+        words = new_words(len(self.ram), self._data_width)
+        copy_words(words, 0, self.ram)
+        self.ram = words
+        self.shared.close(unlink)
+
+
+# Print the state shared by a running simulation every `interval` seconds.
+def main():
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} name|path [interval]")
+        return
+    if os.path.exists(sys.argv[1]):
+        state = SharedState.attach(path=sys.argv[1])
+    else:
+        state = SharedState.attach(name=sys.argv[1])
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    try:
+        while True:
+            cycles, values = state.snapshot()
+            print(
+                f"cycle {cycles}:",
+                " ".join(f"{k}=0x{v:02x}" for k, v in values.items()),
+            )
+            for i in range(0, 0x100, 16):
+                print(
+                    "{:04x}: {}".format(
+                        i, " ".join("{:02x}".format(b) for b in state.ram[i : i + 16])
+                    )
+                )
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
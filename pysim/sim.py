@@ -1,169 +1,1429 @@
+import abc
+import contextlib
+import json
 import math
+import mmap
+import os
 import random
-
-warn_messages = set()
+import sys
+import threading
+import time
+from array import array
 
 
 def warn(msg, dedup=False, **kwargs):
-    if dedup and msg in warn_messages:
-        return
-    warn_messages.add(msg)
-    print(msg, **kwargs)
+    simulation().warn(msg, dedup=dedup, **kwargs)
+
+
+# Log levels, from least to most verbose. Each component has its own level (see
+# Simulation.set_log_level), and checks it before building a message, e.g.
+#   if self._log >= TRACE:
+#       self.trace("{} = 0x{:04x}", self.name(), self.v)
+# so that disabled logging doesn't cost anything beyond the comparison.
+_LOG_LEVELS = {"off": 0, "debug": 1, "trace": 2}
+DEBUG = 1
+TRACE = 2
+
+
+# Messages are formatted with str.format, but only once they're going to be printed.
+def _log(msg, args, kwargs):
+    print(msg.format(*args) if args else msg, **kwargs)
+
+
+# For messages that don't come from a component; uses the simulation's level.
+def debug(msg, *args, **kwargs):
+    if simulation().log_level >= DEBUG:
+        _log(msg, args, kwargs)
+
+
+def trace(msg, *args, **kwargs):
+    if simulation().log_level >= TRACE:
+        _log(msg, args, kwargs)
+
+
+# Pin values are stored one byte (0/1) per bit, least significant bit first. These
+# translate between that and the ASCII binary strings used by format() and int().
+_BITS_FROM_ASCII = bytes.maketrans(b"01", b"\x00\x01")
+_ASCII_FROM_BITS = bytes.maketrans(b"\x00\x01", b"01")
+
+
+def int_to_bits(v, width):
+    return f"{v:0{width}b}"[::-1].encode().translate(_BITS_FROM_ASCII)
+
+
+def bits_to_int(bits):
+    return int(bits[::-1].translate(_ASCII_FROM_BITS), 2)
+
+
+# Flat per-pin state for every pin in the design, indexed by Pin._id.
+# Pins get their id when they are created. freeze() then assigns dense ids to the
+# live nets and components and builds the tables used by the propagation path, so
+# that Net.update works on integer indexes rather than walking Pin objects.
+# Connecting pins after freeze() marks the netlist as stale and it will be frozen
+# again before the next settle.
+class Netlist:
+    def __init__(self, sim):
+        self.sim = sim
+        self.scheduler = sim.scheduler
+
+        # id -> Pin, id -> Signal
+        self.pins = []
+        self.pin_signal = []
+        # Per-pin state. Edge is -1 when there has been no edge since the last had_edge.
+        self.value = bytearray()
+        self.hiz = bytearray()
+        self.edge = array("b")
+
+        # Built by freeze().
+        self.frozen = False
+        # id -> Net, id -> Component
+        self.nets = []
+        self.components = []
+        # Pin id -> net id (-1 if unconnected).
+        self.pin_net = array("l")
+        # New pin value -> pin id -> Signal to notify when the pin changes to that value
+        # (or None). Signals that only trigger on one edge only appear in one of these.
+        self.pin_notify = ([], [])
+        # Net id -> tuple of pin ids.
+        self.net_pins = []
+        # Word-level buses found by freeze().
+        self.buses = []
+
+    def add_pin(self, p):
+        self.pins.append(p)
+        self.pin_signal.append(p._signal)
+        self.value.append(0)
+        self.hiz.append(1)
+        self.edge.append(-1)
+        self.frozen = False
+        return len(self.pins) - 1
+
+    def freeze(self):
+        self.nets = []
+        self.net_pins = []
+        self.pin_net = array("l", [-1]) * len(self.pins)
+        # Only nets that haven't been merged into another are kept. Nets that gained
+        # multiple drivers will be found again below.
+        self.sim.nets = [n for n in self.sim.nets if not n._parent]
+        self.scheduler.contention = {}
+        for n in self.sim.nets:
+            n._target = n
+            n._id = len(self.nets)
+            n._ids = tuple(p._id for p in n.pins())
+            for i in n._ids:
+                self.pins[i]._net = n
+            n._drivers = {i: None for i in n._ids if not self.hiz[i]}
+            n._value = None
+            n._released = []
+            if len(n._drivers) > 1:
+                self.scheduler.contention[n] = None
+            self.nets.append(n)
+            self.net_pins.append(n._ids)
+            for i in n._ids:
+                self.pin_net[i] = n._id
+
+        for c in self.components:
+            c._id = None
+        self.components = []
+        self.pin_notify = ([], [])
+        for p in self.pins:
+            s = p._signal
+            c = s._component
+            if c._id is None:
+                c._id = len(self.components)
+                self.components.append(c)
+            for v in (0, 1):
+                self.pin_notify[v].append(s if s._wake >> v & 1 else None)
+
+        self._find_buses()
+
+        if self.scheduler._mode == "levelized":
+            self._levelize()
+
+        self.frozen = True
+
+    # Finds runs of nets that connect the same signals bit-for-bit (e.g. from
+    # `a.data += b.data`) and replaces each run with a single Bus. Net k+1 is the
+    # successor of net k if its pins are exactly the pins of net k shifted up by one
+    # bit within the same signals. Pin ids within a signal are contiguous, so this is
+    # just arithmetic on ids.
+    def _find_buses(self):
+        self.buses = []
+        pin_net = self.pin_net
+        pin_signal = self.pin_signal
+        n_pins = len(self.pins)
+        n_nets = len(self.nets)
+        succ = [-1] * n_nets
+        has_pred = bytearray(n_nets)
+        for n, ids in enumerate(self.net_pins):
+            if self.nets[n]._pull is not None:
+                continue
+            # Every pin must have a next bit in the same signal.
+            if not all(
+                i + 1 < n_pins and pin_signal[i + 1] is pin_signal[i] for i in ids
+            ):
+                continue
+            m = pin_net[ids[0] + 1]
+            if m < 0 or m == n or self.nets[m]._pull is not None:
+                continue
+            if set(i + 1 for i in ids) == set(self.net_pins[m]):
+                succ[n] = m
+                has_pred[m] = 1
+
+        for n in range(n_nets):
+            if has_pred[n] or succ[n] < 0:
+                continue
+            nets = []
+            while n >= 0:
+                nets.append(self.nets[n])
+                n = succ[n]
+            bus = Bus(nets)
+            self.buses.append(bus)
+            for n in nets:
+                n._target = bus
+
+        # Let full-signal drives write whole bus segments at once.
+        starts = {}
+        for bus in self.buses:
+            for a in bus._starts:
+                starts[a] = bus
+        # Signals that aren't on any bus just drive their pins one at a time.
+        bus_signals = {sig for bus in self.buses for sig in bus._signals}
+        for p in self.pins:
+            sig = p._signal
+            if p._id == sig._ids[0]:
+                if sig in bus_signals:
+                    sig._view._segments = self._segments(sig, starts)
+                else:
+                    sig._view._segments = None
+
+    # The combinational dependency graph, with an input and an output node for every
+    # signal: signal k's input is node 2k and its output is node 2k + 1. An output
+    # depends on the inputs given by its component's combinational_paths(), and an
+    # input depends on the outputs that drive a net it's on. Only NotifySignals that
+    # wake their component on any change are inputs; edge-triggered ones (e.g. a
+    # register's `we`) latch rather than pass values through, and so do plain Signals
+    # read inside update(). Outputs are plain Signals, NotifySignals listed in
+    # combinational_paths(), and NotifySignals that are currently driving. A
+    # component reading its own output is up to that component.
+    # Returns the signals, the successors of each node, and the nets that connect
+    # each pair of nodes joined by a net.
+    def _dependencies(self):
+        pin_signal = self.pin_signal
+        signals = []
+        index = {}
+        for i, sig in enumerate(pin_signal):
+            if i == sig._ids[0]:
+                index[sig] = len(signals)
+                signals.append(sig)
+        succ = [set() for _ in range(2 * len(signals))]
+        via = {}
+
+        by_component = {}
+        for sig in signals:
+            by_component.setdefault(sig._component, []).append(sig)
+        paths = {c: c.combinational_paths() for c in by_component}
+
+        drives = bytearray(len(signals))
+        for k, sig in enumerate(signals):
+            a = sig._ids[0]
+            if (
+                not sig._wake
+                or sig in paths[sig._component]
+                or self.hiz.find(0, a, a + len(sig._ids)) >= 0
+            ):
+                drives[k] = 1
+
+        for c, sigs in by_component.items():
+            inputs = [index[s] for s in sigs if s._wake == 3]
+            for s in sigs:
+                k = index[s]
+                if not drives[k]:
+                    continue
+                deps = paths[c].get(s)
+                deps = inputs if deps is None else [index[d] for d in deps]
+                for d in deps:
+                    if signals[d]._wake == 3:
+                        succ[2 * d].add(2 * k + 1)
+
+        for n, ids in enumerate(self.net_pins):
+            drivers = set()
+            readers = set()
+            for i in ids:
+                k = index[pin_signal[i]]
+                if signals[k]._wake == 3:
+                    readers.add(k)
+                if drives[k]:
+                    drivers.add(k)
+            for d in drivers:
+                for r in readers:
+                    if signals[d]._component is not signals[r]._component:
+                        succ[2 * d + 1].add(2 * r)
+                        via.setdefault((2 * d + 1, 2 * r), []).append(n)
+        return signals, succ, via
+
+    # Finds groups of components that depend on each other combinationally, i.e.
+    # that could keep changing each other's inputs without a clock edge. Returns a
+    # (components, nets) pair for each group.
+    def combinational_loops(self):
+        signals, succ, via = self._dependencies()
+        loops = []
+        for scc in _strongly_connected(succ):
+            if len(scc) < 2:
+                continue
+            members = set(scc)
+            components = {signals[v // 2]._component for v in scc}
+            nets = set()
+            for (d, r), ks in via.items():
+                if d in members and r in members:
+                    nets.update(ks)
+            loops.append(
+                (
+                    sorted(components, key=lambda c: c._id),
+                    [self.nets[k] for k in sorted(nets)],
+                )
+            )
+        return loops
+
+    # Assigns every component a level such that it comes after the components that
+    # drive its inputs combinationally (see _dependencies), for the levelized
+    # scheduler. A registered output doesn't depend on any inputs, so it's at level
+    # 0 and what it drives doesn't have to wait for its component. Signals in a
+    # combinational loop share a level, and the loop is reported here.
+    def _levelize(self):
+        signals, succ, via = self._dependencies()
+        sccs = _strongly_connected(succ)
+        scc_of = [0] * len(succ)
+        for k, scc in enumerate(sccs):
+            for v in scc:
+                scc_of[v] = k
+            if len(scc) > 1:
+                self.sim.warn(
+                    "Warning: combinational loop between {}".format(
+                        ", ".join(
+                            sorted({signals[v // 2]._component.name() for v in scc})
+                        )
+                    ),
+                    dedup=True,
+                )
+
+        # SCCs come out in reverse topological order.
+        level = [0] * len(sccs)
+        for k in range(len(sccs) - 1, -1, -1):
+            for v in sccs[k]:
+                for w in succ[v]:
+                    m = scc_of[w]
+                    if m != k:
+                        level[m] = max(level[m], level[k] + 1)
+        for c in self.components:
+            c._level = 0
+        for k, sig in enumerate(signals):
+            c = sig._component
+            c._level = max(c._level, level[scc_of[2 * k]])
+
+    # Splits a signal into (bit offset, width, first pin id, bus) segments, where bus
+    # is None for single pins that aren't part of a bus. `starts` maps the first pin id
+    # of each bus member to its bus.
+    def _segments(self, sig, starts):
+        segments = []
+        lo = 0
+        while lo < len(sig._ids):
+            i = sig._ids[lo]
+            bus = starts.get(i)
+            if bus is not None:
+                segments.append((lo, bus._width, i, bus))
+                lo += bus._width
+            else:
+                segments.append((lo, 1, i, None))
+                lo += 1
+        return segments
+
+
+# Returns the strongly connected components of a graph given as a list of successor
+# sets, in reverse topological order (Tarjan's algorithm, without recursion).
+def _strongly_connected(succ):
+    index = [-1] * len(succ)
+    low = [0] * len(succ)
+    on_stack = bytearray(len(succ))
+    stack = []
+    result = []
+    counter = 0
+    for root in range(len(succ)):
+        if index[root] >= 0:
+            continue
+        work = [(root, iter(succ[root]))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        while work:
+            v, it = work[-1]
+            for w in it:
+                if index[w] < 0:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = 1
+                    work.append((w, iter(succ[w])))
+                    break
+                elif on_stack[w]:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    scc = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        scc.append(w)
+                        if w == v:
+                            break
+                    result.append(scc)
+    return result
+
+
+# Delta-cycle scheduler.
+# A pin that changes state marks its net dirty, and a net that changes the value of
+# a hi-z pin queues that pin's component. settle() alternates between resolving the
+# dirty nets and evaluating the queued components (each at most once per delta) until
+# nothing is left to do. Drives made outside of settle() (e.g. from main or reset())
+# settle immediately, so the circuit is always quiescent when control returns. A
+# multi-bit drive is held until all of its bits are written, so nothing ever sees
+# a half-updated bus.
+_DEFAULT_SETTLE_BUDGET = 10000
+# Delta cycles to watch after the budget is exceeded to see what's oscillating.
+_OSCILLATION_TRACE = 16
+
+
+class Scheduler:
+    def __init__(self, sim):
+        self._sim = sim
+        self._nets = {}
+        self._components = {}
+        # Edge-triggered handlers that are waiting for the rest of the circuit to
+        # settle, see component_changed.
+        self._sampling = {}
+        self._running = False
+        self._held = 0
+        self._mode = "delta"
+        # Delta cycles allowed in one settle() before the circuit is considered to be
+        # oscillating.
+        self._settle_budget = _DEFAULT_SETTLE_BUDGET
+        # The nets and components seen changing since the budget was exceeded.
+        self._oscillating = None
+        # With deferred commits, the drives made by components in the current delta
+        # cycle, as SignalView -> value. None when drives are committed immediately.
+        self._staged = None
+        # Specialized net update and signal drive functions installed by codegen, or
+        # None. They're only valid for the netlist they were generated from.
+        self._compiled = None
+        self._compiled_drives = {}
+        # The active Profile, if any.
+        self.profile = None
+        self.deltas = 0
+        self.net_updates = 0
+
+        # Nets that have gained a driver since the last contention check. Only these
+        # can have started having multiple drivers.
+        self.contention = {}
+        self._contention_mode = "always"
+        self._contention_every = 1
+        self._ticks = 0
+
+    # Choose how settle() orders component evaluations: "delta" evaluates everything
+    # that's pending in each delta cycle, "levelized" evaluates pending components in
+    # the order given by Netlist._levelize (lowest level first), so that a component
+    # normally runs once per clock phase, after everything that drives its inputs.
+    def set_mode(self, mode):
+        if mode not in ("delta", "levelized"):
+            raise ValueError(f"Unknown scheduler mode: {mode}")
+        self._mode = mode
+        self._sim.netlist.frozen = False
+
+    # Choose when drives made by components during settle() take effect:
+    # "immediate" as each one is made, or "deferred" once every component in the
+    # delta cycle has been updated. With deferred commits, components in a delta cycle
+    # all see the same state, and only their last drive of each signal is applied, so
+    # e.g. driving 0 then None on a released bus doesn't disturb it. The values
+    # components see then don't depend on the order they're updated in. Which
+    # `signal` is passed to update() when several inputs changed in the same delta
+    # cycle, and the order of side effects such as printing, still do.
+    def set_commit_mode(self, mode):
+        if mode not in ("immediate", "deferred"):
+            raise ValueError(f"Unknown commit mode: {mode}")
+        self._staged = {} if mode == "deferred" else None
+        # Generated drive functions commit immediately, so they're only installed by
+        # the next compile.
+        self.uninstall()
+
+    # Use generated functions (see codegen.py) to update nets, keyed by Net or Bus,
+    # and to drive signals, keyed by Signal.
+    def install(self, updates, drives):
+        self.uninstall()
+        self._compiled = updates
+        if self._staged is not None:
+            drives = {}
+        self._compiled_drives = drives
+        for sig, fn in drives.items():
+            sig._drive_fn = fn
+
+    def uninstall(self):
+        for sig in self._compiled_drives:
+            sig._drive_fn = None
+        self._compiled = None
+        self._compiled_drives = {}
+
+    # Limit the number of delta cycles that one settle() can take (None for no
+    # limit). A circuit that's still changing after that many raises an exception
+    # naming the components and nets involved.
+    def set_settle_budget(self, deltas):
+        if deltas is None:
+            deltas = math.inf
+        elif deltas < 1:
+            raise ValueError(f"Invalid settle budget: {deltas}")
+        self._settle_budget = deltas
+
+    # Configure how often end_tick() checks for multiple drivers on a net:
+    # "always" after every tick, "sampled" after every `every` ticks, or "off".
+    def set_contention_check(self, mode, every=1):
+        if mode not in ("always", "sampled", "off"):
+            raise ValueError(f"Unknown contention check mode: {mode}")
+        if every < 1:
+            raise ValueError(f"Invalid contention check interval: {every}")
+        self._contention_mode = mode
+        self._contention_every = every if mode == "sampled" else 1
+
+    # Called by Clock after each tick.
+    def end_tick(self):
+        self._ticks += 1
+        if self._contention_mode == "off":
+            self.contention = {}
+            return
+        if self._ticks % self._contention_every:
+            return
+        for n in self.contention:
+            n.check_drivers()
+        self.contention = {}
+
+    # Don't settle until the matching release(). Holds nest, and the circuit settles
+    # when the outermost one is released.
+    def hold(self):
+        self._held += 1
+
+    def release(self):
+        self._held -= 1
+        if not self._held:
+            self.settle()
+
+    # Called by a pin whose driven state changed.
+    def net_changed(self, net):
+        self._nets[net._target] = None
+        if not self._running:
+            self.settle()
+
+    # Called instead of driving when commits are deferred. A later drive of the same
+    # view replaces an earlier one, and is applied after any drives made in between.
+    def stage(self, view, v):
+        staged = self._staged
+        staged.pop(view, None)
+        staged[view] = v
+
+    # Called by a NotifySignal when one of its pins changed value. The target is the
+    # component, or the signal itself if it has a handler.
+    # Handlers for a rising or falling edge sample their other inputs, so they run
+    # once everything else woken with them has updated and its drives have reached
+    # the nets. E.g. a register whose write enable rises along with the output
+    # enable of the memory that drives its input then latches the memory's data,
+    # rather than whatever was on the bus before.
+    def component_changed(self, target, signal):
+        if target._samples:
+            self._sampling[target] = signal
+        else:
+            self._components[target] = signal
+
+    # Run delta cycles until there are no dirty nets or pending components.
+    def settle(self):
+        if self._running or self._held:
+            return
+        self._running = True
+        netlist = self._sim.netlist
+        try:
+            if not netlist.frozen:
+                self.uninstall()
+                # Nets queued before re-freezing may since have been merged into another
+                # net, and the old buses are replaced.
+                nets = []
+                for n in self._nets:
+                    nets.extend(n._nets if isinstance(n, Bus) else (n,))
+                netlist.freeze()
+                self._nets = {n._find()._target: None for n in nets}
+            levelized = self._mode == "levelized"
+            budget = self._settle_budget
+            deltas = 0
+            while self._nets or self._components or self._sampling:
+                nets = self._nets
+                self._nets = {}
+                compiled = self._compiled
+                if self.profile is not None:
+                    self.profile.update_nets(nets, compiled)
+                elif compiled is None:
+                    for n in nets:
+                        n.update()
+                else:
+                    for n in nets:
+                        compiled[n]()
+
+                deltas += 1
+                if deltas > budget:
+                    self._trace_oscillation(nets, deltas - budget)
+
+                if levelized:
+                    self._run_level()
+                    continue
+
+                components = self._components
+                if components:
+                    self._components = {}
+                elif not self._nets:
+                    components = self._sampling
+                    self._sampling = {}
+                if components:
+                    self.deltas += 1
+                    self._update(components)
+        finally:
+            self._running = False
+
+    # Called for each delta cycle past the settle budget. Collects what's still
+    # changing for a few more cycles, then gives up.
+    def _trace_oscillation(self, nets, n):
+        if n == 1:
+            self._oscillating = ({}, {})
+        trace_nets, trace_components = self._oscillating
+        trace_nets.update(nets)
+        for pending in (self._components, self._sampling):
+            for s in pending.values():
+                trace_components[s._component] = None
+        if n <= _OSCILLATION_TRACE:
+            return
+        self._oscillating = None
+        msg = "Circuit didn't settle after {} delta cycles. Still changing: {}; nets {}".format(
+            self._settle_budget,
+            ", ".join(sorted(c.name() for c in trace_components)),
+            ", ".join(sorted(net.name() for net in trace_nets)),
+        )
+        # The combinational loops that what's changing is part of, if any. Without
+        # one, something is re-triggering itself through a clocked path.
+        for components, _ in self._sim.netlist.combinational_loops():
+            if any(c in trace_components for c in components):
+                msg += "; combinational loop between {}".format(
+                    ", ".join(c.name() for c in components)
+                )
+        raise Exception(msg)
+
+    def _update(self, components):
+        if self.profile is None:
+            for c, s in components.items():
+                c.update(signal=s)
+        else:
+            self.profile.update(components)
+        if self._staged:
+            staged = self._staged
+            self._staged = {}
+            if self.profile is None:
+                for view, v in staged.items():
+                    view._drive(v)
+            else:
+                self.profile.commit(staged)
+
+    # Evaluate the pending components at the lowest pending level, or once there are
+    # none, the edge-triggered handlers at the lowest pending level.
+    def _run_level(self):
+        pending = self._components
+        if not pending:
+            if self._nets:
+                return
+            pending = self._sampling
+            if not pending:
+                return
+        level = min(s._component._level for s in pending.values())
+        components = {}
+        for c, s in pending.items():
+            if s._component._level == level:
+                components[c] = s
+        for c in components:
+            del pending[c]
+        self.deltas += 1
+        self._update(components)
+
+
+# Opt-in per-component profiling. While started, records for every component how
+# many times it was updated, the time spent in its updates, how many drives of its
+# signals were made (and how many pins that covered), and how many nets became
+# dirty as a result of its updates. Updates are called by the scheduler one at a
+# time, so the time is self time; the rest of settle() is net propagation.
+# Drives are counted by wrapping each signal's drive function (see
+# Scheduler.install), so profiling costs nothing while it's stopped.
+#
+# It also records, for every net (or bus) that the scheduler updates, how many
+# times it was updated, how many times each bit toggled, how many components its
+# updates woke, and how many times the pin driving it changed. Nets are only named
+# when reporting.
+class Profile:
+    # Column name -> index into a component's counters.
+    _COLUMNS = {"updates": 0, "time": 1, "drives": 2, "pins": 3, "nets": 4}
+
+    def __init__(self, sim):
+        self._sim = sim
+        self._stats = {}
+        self._net_stats = {}
+        self._drives = {}
+        self._started = None
+        self.elapsed = 0
+
+    def _counters(self, component):
+        st = self._stats.get(component)
+        if st is None:
+            st = self._stats[component] = [0, 0, 0, 0, 0]
+        return st
+
+    def start(self):
+        sched = self._sim.scheduler
+        if sched.profile is not None:
+            raise Exception("A profile is already running")
+        sched.profile = self
+        for i, sig in enumerate(self._sim.netlist.pin_signal):
+            if i == sig._ids[0]:
+                fn = self._counting_drive(sig, sig._drive_fn)
+                self._drives[sig] = (sig._drive_fn, fn)
+                sig._drive_fn = fn
+        self._started = time.perf_counter()
+
+    def stop(self):
+        self.elapsed += time.perf_counter() - self._started
+        self._sim.scheduler.profile = None
+        for sig, (original, fn) in self._drives.items():
+            # The scheduler drops generated drive functions if the netlist changes.
+            if sig._drive_fn is fn:
+                sig._drive_fn = original
+        self._drives = {}
+
+    def _counting_drive(self, sig, fn):
+        st = self._counters(sig._component)
+        n = len(sig)
+        if fn is None:
+            fn = sig._view.__ilshift__
+
+        def drive(v):
+            st[2] += 1
+            st[3] += n
+            fn(v)
+
+        return drive
+
+    # Called by the scheduler instead of updating the components itself.
+    def update(self, components):
+        sched = self._sim.scheduler
+        clock = time.perf_counter
+        for c, s in components.items():
+            st = self._counters(s._component)
+            n = len(sched._nets)
+            t = clock()
+            c.update(signal=s)
+            st[1] += clock() - t
+            st[0] += 1
+            st[4] += len(sched._nets) - n
+
+    # Called by the scheduler to apply deferred drives.
+    def commit(self, staged):
+        sched = self._sim.scheduler
+        for view, v in staged.items():
+            n = len(sched._nets)
+            view._drive(v)
+            self._counters(view._signal._component)[4] += len(sched._nets) - n
+
+    # Called by the scheduler instead of updating the dirty nets itself.
+    def update_nets(self, nets, compiled):
+        sched = self._sim.scheduler
+        stats = self._net_stats
+        for n in nets:
+            st = stats.get(n)
+            if st is None:
+                # [updates, wakes, driver changes, toggles per bit, driver, bits]
+                st = stats[n] = [0, 0, 0, [0] * _net_width(n), None, None]
+            k = len(sched._components) + len(sched._sampling)
+            if compiled is None:
+                n.update()
+            else:
+                compiled[n]()
+            st[0] += 1
+            st[1] += len(sched._components) + len(sched._sampling) - k
+            d = n._nets[0].driver() if isinstance(n, Bus) else n.driver()
+            if d != st[4]:
+                if st[4] is not None:
+                    st[2] += 1
+                st[4] = d
+            bits = _net_bits(n)
+            if st[5] is not None:
+                toggles = st[3]
+                for i, (a, b) in enumerate(zip(st[5], bits)):
+                    if a != b and a is not None and b is not None:
+                        toggles[i] += 1
+            st[5] = bits
+
+    # One row per net or bus that was updated, sorted by a column, largest first.
+    def net_rows(self, sort="updates"):
+        if sort not in ("updates", "toggles", "wakes", "churn", "fanout", "pins"):
+            raise ValueError(f"Unknown profile column: {sort}")
+        nl = self._sim.netlist
+        rows = []
+        for n, st in self._net_stats.items():
+            if isinstance(n, Bus):
+                pins = n._width * len(n._starts)
+                fanout = sum(1 for w in n._wake if w)
+            else:
+                pins = len(n._ids)
+                fanout = sum(
+                    1 for i in n._ids if nl.pin_notify[0][i] or nl.pin_notify[1][i]
+                )
+            rows.append(
+                {
+                    "name": n.name(),
+                    "width": len(st[3]),
+                    "pins": pins,
+                    "fanout": fanout,
+                    "updates": st[0],
+                    "toggles": sum(st[3]),
+                    "wakes": st[1],
+                    "churn": st[2],
+                    "bit_toggles": st[3],
+                }
+            )
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows
+
+    def net_table(self, sort="updates", limit=None):
+        rows = self.net_rows(sort)
+        total = sum(row["updates"] for row in rows) or 1
+        rows = rows[:limit]
+        lines = [
+            f"{'updates':>9} {'upd%':>6} {'toggles':>9} {'wakes':>9} {'churn':>7} {'width':>5} {'pins':>5} {'fanout':>6}  name"
+        ]
+        for row in rows:
+            lines.append(
+                f"{row['updates']:>9} {row['updates'] * 100 / total:>5.1f}% {row['toggles']:>9} {row['wakes']:>9} {row['churn']:>7} {row['width']:>5} {row['pins']:>5} {row['fanout']:>6}  {row['name']}"
+            )
+        return "\n".join(lines)
+
+    # Rows of counters, one per component (by="component"), per component class
+    # (by="class") or per net (by="net", see net_rows), sorted by a column, largest
+    # first.
+    def rows(self, by="component", sort=None):
+        if by == "net":
+            return self.net_rows(sort or "updates")
+        if by not in ("component", "class"):
+            raise ValueError(f"Unknown profile grouping: {by}")
+        sort = sort or "time"
+        if sort not in self._COLUMNS:
+            raise ValueError(f"Unknown profile column: {sort}")
+        groups = {}
+        for c, st in self._stats.items():
+            if by == "component":
+                key = (c.name(), type(c).__name__, id(c))
+            else:
+                key = (type(c).__name__,)
+            g = groups.setdefault(key, [0, 0, 0, 0, 0, 0])
+            for k, v in enumerate(st):
+                g[k] += v
+            g[5] += 1
+        rows = []
+        for key, g in groups.items():
+            row = {"name": key[0]} if by == "component" else {}
+            row["class"] = key[1] if by == "component" else key[0]
+            if by == "class":
+                row["instances"] = g[5]
+            for col, k in self._COLUMNS.items():
+                row[col] = g[k]
+            rows.append(row)
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows
+
+    def table(self, by="component", sort=None):
+        if by == "net":
+            return self.net_table(sort or "updates")
+        rows = self.rows(by, sort)
+        total = sum(row["time"] for row in rows) or 1
+        first = "name" if by == "component" else "class"
+        second = "class" if by == "component" else "instances"
+        width = max([len(first)] + [len(str(row[first])) for row in rows])
+        width2 = max([len(second)] + [len(str(row[second])) for row in rows])
+        lines = [
+            f"{first:<{width}}  {second:<{width2}}  {'updates':>9} {'time ms':>9} {'time%':>6} {'drives':>9} {'pins':>9} {'nets':>9}"
+        ]
+        for row in rows:
+            lines.append(
+                f"{row[first]:<{width}}  {row[second]:<{width2}}  {row['updates']:>9} {row['time'] * 1000:>9.1f} {row['time'] * 100 / total:>5.1f}% {row['drives']:>9} {row['pins']:>9} {row['nets']:>9}"
+            )
+        lines.append(
+            f"{total * 1000:.1f} ms in updates of {self.elapsed * 1000:.1f} ms profiled"
+        )
+        return "\n".join(lines)
+
+    def json(self, by="component", sort=None):
+        return json.dumps(
+            {"elapsed": self.elapsed, "rows": self.rows(by, sort)}, indent=2
+        )
+
+
+def _net_width(net):
+    return net._width if isinstance(net, Bus) else 1
+
+
+# The value last propagated by a net or bus, per bit (None if unknown).
+def _net_bits(net):
+    if not isinstance(net, Bus):
+        return (net._value,)
+    if net._bits is not None:
+        return net._bits
+    # Resolved bit-by-bit.
+    return [n._value for n in net._nets]
+
+
+# Owns everything about one simulated circuit: its nets, the flat pin tables, the
+# scheduler, counters and warning state. Components belong to the simulation that
+# was active when they were created, either from `with Simulation() as sim:` or the
+# default simulation if none is active. Independent simulations can coexist in one
+# process (and in different threads), and are garbage collected like anything else.
+class Simulation:
+    def __init__(self):
+        self.nets = []
+        self.warn_messages = set()
+        self.scheduler = Scheduler(self)
+        self.netlist = Netlist(self)
+        # Default log level, and overrides by component class and by component.
+        self.log_level = 0
+        self._log_classes = {}
+        self._log_components = {}
+
+    def __enter__(self):
+        _active_simulations().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_simulations().pop()
+
+    @property
+    def net_updates(self):
+        return self.scheduler.net_updates
+
+    def warn(self, msg, dedup=False, **kwargs):
+        if dedup and msg in self.warn_messages:
+            return
+        self.warn_messages.add(msg)
+        print(msg, **kwargs)
+
+    def freeze(self):
+        self.netlist.freeze()
+
+    def settle(self):
+        self.scheduler.settle()
+
+    # Drives made inside `with sim.batch():` are all applied before the circuit
+    # settles, e.g. to change an address and a write enable together.
+    @contextlib.contextmanager
+    def batch(self):
+        self.scheduler.hold()
+        try:
+            yield
+        finally:
+            self.scheduler.release()
+
+    def set_mode(self, mode):
+        self.scheduler.set_mode(mode)
+
+    def set_contention_check(self, mode, every=1):
+        self.scheduler.set_contention_check(mode, every)
+
+    def set_settle_budget(self, deltas):
+        self.scheduler.set_settle_budget(deltas)
+
+    def set_commit_mode(self, mode):
+        self.scheduler.set_commit_mode(mode)
+
+    # See Netlist.combinational_loops.
+    def combinational_loops(self):
+        if not self.netlist.frozen:
+            self.settle()
+        return self.netlist.combinational_loops()
+
+    # Profile the components for the duration of a `with sim.profile() as p:` block.
+    @contextlib.contextmanager
+    def profile(self):
+        p = Profile(self)
+        p.start()
+        try:
+            yield p
+        finally:
+            p.stop()
+
+    # Set the log level ("off", "debug" or "trace") of every component, of every
+    # component of a class (including ones created later), or of one component. A
+    # component's own level takes precedence over its class's, which takes
+    # precedence over the default.
+    def set_log_level(self, level, target=None):
+        if level not in _LOG_LEVELS:
+            raise ValueError(f"Unknown log level: {level}")
+        if target is None:
+            self.log_level = _LOG_LEVELS[level]
+        elif isinstance(target, type):
+            self._log_classes[target] = _LOG_LEVELS[level]
+        else:
+            self._log_components[target] = _LOG_LEVELS[level]
+        for c in {s._component for s in self.netlist.pin_signal}:
+            c._log = self._component_log_level(c)
+
+    def _component_log_level(self, component):
+        level = self._log_components.get(component)
+        if level is not None:
+            return level
+        for cls in type(component).__mro__:
+            level = self._log_classes.get(cls)
+            if level is not None:
+                return level
+        return self.log_level
+
+
+_local = threading.local()
+_default_simulation = None
+
 
+def _active_simulations():
+    if not hasattr(_local, "active"):
+        _local.active = []
+    return _local.active
 
-def debug(msg, **kwargs):
-    # print(msg, **kwargs)
-    pass
 
+# Returns the simulation that new components will be added to.
+def simulation():
+    global _default_simulation
+    active = _active_simulations()
+    if active:
+        return active[-1]
+    if _default_simulation is None:
+        _default_simulation = Simulation()
+    return _default_simulation
 
-def trace(msg, **kwargs):
-    # print(msg, **kwargs)
-    pass
 
+def freeze():
+    simulation().freeze()
 
-all_nets = []
+
+def settle():
+    simulation().settle()
+
+
+def batch():
+    return simulation().batch()
+
+
+def set_mode(mode):
+    simulation().set_mode(mode)
+
+
+def set_contention_check(mode, every=1):
+    simulation().set_contention_check(mode, every)
+
+
+def set_settle_budget(deltas):
+    simulation().set_settle_budget(deltas)
+
+
+def set_commit_mode(mode):
+    simulation().set_commit_mode(mode)
+
+
+def combinational_loops():
+    return simulation().combinational_loops()
+
+
+def set_log_level(level, target=None):
+    simulation().set_log_level(level, target)
+
+
+def profile():
+    return simulation().profile()
 
 
 # Represents a set of connected pins with optional pull up/down.
 # Not used directly - when pins connect they create/merge nets.
-# When a pin changes state (e.g. into hi-z mode or driving high/low) it calls update
-# which will update all connected pins.
+# When a pin changes state (e.g. into hi-z mode or driving high/low) the net is marked
+# dirty and the scheduler calls update, which will update all connected pins.
 class Net:
-    net_updates = 0
+    __slots__ = (
+        "_netlist",
+        "_scheduler",
+        "_pull",
+        "_parent",
+        "_size",
+        "_head",
+        "_tail",
+        "_id",
+        "_ids",
+        "_target",
+        "_drivers",
+        "_value",
+        "_released",
+    )
 
     def __init__(self, pins):
-        self._pins = pins
+        self._netlist = pins[0]._netlist
+        self._scheduler = self._netlist.scheduler
         self._pull = None
-        all_nets.append(self)
+        # Connections are built as a union-find forest. A net that gets merged into
+        # another points at it through _parent, and the pins of a net form a linked
+        # list (through Pin._link) so that merging two nets is O(1). freeze() walks the
+        # lists to give every pin its final net, and drops the merged nets.
+        self._parent = None
+        self._size = len(pins)
+        self._head = pins[0]
+        self._tail = pins[-1]
+        for a, b in zip(pins, pins[1:]):
+            a._link = b
+        pins[-1]._link = None
+        # Assigned by Netlist.freeze().
+        self._id = None
+        self._ids = ()
+        # What the scheduler updates when this net changes: itself, or its Bus.
+        self._target = self
+        # Incrementally maintained by Pin as pins start and stop driving (and rebuilt by
+        # freeze). Ordered by when each pin started driving.
+        self._drivers = {}
+        # The value last propagated to the hi-z pins (None if unknown), and the pins
+        # that have been released since then. While the net's value doesn't change,
+        # only the released pins can be out of date.
+        self._value = None
+        self._released = []
+        self._netlist.sim.nets.append(self)
 
     def name(self):
-        return "/".join(p.fullname() for p in self._pins)
-
-    # Gets a driving pin on this net.
+        return "/".join(p.fullname() for p in self.pins())
+
+    # Iterates the pins in this net, in the order they were connected.
+    def pins(self):
+        p = self._find()._head
+        while p:
+            yield p
+            p = p._link
+
+    # Returns the net that this net has been merged into (or itself).
+    def _find(self):
+        n = self
+        while n._parent:
+            # Path halving: skip every other step, so chains get shorter each time.
+            if n._parent._parent:
+                n._parent = n._parent._parent
+            n = n._parent
+        return n
+
+    # Gets the id of a driving pin on this net (or -1).
     def driver(self):
-        d = None
-        for p in self._pins:
-            if not p.is_hiz():
-                # Always return the first one. It's not uncommon for there to be multiple drivers
-                # while updates propogate, but it should stabilize.
-                # if d:
-                #  warn('Warning: Multiple drivers on {}: {} {}'.format(self.name(), d.fullname(), p.fullname()), dedup=True)
-                d = p
-        return d
+        if not self._drivers:
+            return -1
+        # Always return the most recent one. It's not uncommon for there to be multiple
+        # drivers while updates propogate, but it should stabilize.
+        return next(reversed(self._drivers))
 
     def check_drivers(self):
-        d = None
-        for p in self._pins:
-            if not p.is_hiz():
-                if d:
-                    warn(
-                        "Warning: Multiple drivers on {}: {} {}".format(
-                            self.name(), d.fullname(), p.fullname()
-                        ),
-                        dedup=True,
-                    )
-                d = p
-
-    # Called by a pin that is changing state.
+        if len(self._drivers) < 2:
+            return
+        pins = self._netlist.pins
+        d = -1
+        for i in self._drivers:
+            if d >= 0:
+                self._netlist.sim.warn(
+                    "Warning: Multiple drivers on {}: {} {}".format(
+                        self.name(), pins[d].fullname(), pins[i].fullname()
+                    ),
+                    dedup=True,
+                )
+            d = i
+
+    # Called by the scheduler after a pin on this net changed state.
     def update(self):
+        nl = self._netlist
+        hiz = nl.hiz
+        value = nl.value
+
         d = self.driver()
 
-        # Will be None or 0/1.
-        v = self._pull
+        if d >= 0:
+            v = value[d]
+        else:
+            # Will be None or 0/1.
+            v = self._pull
 
-        # If there's no driver and no pull up/down (i.e. the net is floating), then there's
-        # nothing to propogate.
-        # TODO: this would be worth adding a warning for.
-        if not d and not v:
-            return
+            # If there's no driver and no pull up/down (i.e. the net is floating), then there's
+            # nothing to propogate.
+            # TODO: this would be worth adding a warning for.
+            if v is None:
+                return
 
-        Net.net_updates += 1
-        if d:
-            v = d.value()
+        self._scheduler.net_updates += 1
 
         # Update all hi-z pins to match the state of the driving pin on this net.
-        for p in self._pins:
-            if p.is_hiz():
-                p.update(v)
-
-    # Add a pin to this net.
+        if v == self._value:
+            pins = self._released
+        else:
+            pins = self._ids
+            self._value = v
+        self._released = []
+
+        edge = nl.edge
+        notify = nl.pin_notify[v]
+        signals = nl.pin_signal
+        for i in pins:
+            if hiz[i] and value[i] != v:
+                value[i] = v
+                edge[i] = v
+                signals[i]._cached = None
+                s = notify[i]
+                if s:
+                    self._scheduler.component_changed(s._target, s)
+
+    # Add a pin (that isn't already on a net) to this net.
     def append(self, p):
-        if p in self._pins:
-            raise Exception(f'Pin "{p.fullname()}" already in net "{self.name()}"')
-        p._net = self
-        self._pins.append(p)
+        n = self._find()
+        p._net = n
+        p._link = None
+        n._tail._link = p
+        n._tail = p
+        n._size += 1
+        return n
+
+    # Merge this net with another (i.e. they share a pin in common). Returns the
+    # combined net. The pins of this net stay first, and this net's pull up/down wins.
+    def merge(self, other):
+        a = self._find()
+        b = other._find()
+        if a is b:
+            raise Exception(
+                f'Nets "{self.name()}" and "{other.name()}" already connected'
+            )
+        a._tail._link = b._head
+        head, tail, pull = a._head, b._tail, a._pull
+        # Hang the smaller tree under the larger one.
+        if a._size < b._size:
+            a, b = b, a
+        b._parent = a
+        b._head = b._tail = None
+        a._size += b._size
+        a._head, a._tail, a._pull = head, tail, pull
+        return a
+
+
+# A run of nets that connect the same signals bit-for-bit, created by freeze().
+# Each member is a contiguous slice of one signal's pins, so the whole word can be
+# resolved with slice operations on the pin tables and each member's component is
+# notified once rather than once per bit.
+class Bus:
+    __slots__ = (
+        "_netlist",
+        "_scheduler",
+        "_nets",
+        "_width",
+        "_starts",
+        "_members",
+        "_signals",
+        "_wake",
+        "_target",
+        "_driven",
+        "_bits",
+        "_released",
+    )
+
+    def __init__(self, nets):
+        self._netlist = nets[0]._netlist
+        self._scheduler = self._netlist.scheduler
+        self._nets = nets
+        self._width = len(nets)
+        # First pin id of each member slice.
+        self._starts = nets[0]._ids
+        self._members = {a: m for m, a in enumerate(self._starts)}
+        self._signals = [self._netlist.pin_signal[a] for a in self._starts]
+        self._wake = [s._wake for s in self._signals]
+        self._target = self
+        # Number of driven pins across all members, maintained alongside the per-bit
+        # nets' drivers. Along with the first net's drivers, this says which members
+        # are fully driven without scanning the pins.
+        self._driven = sum(len(n._drivers) for n in nets)
+        # As for Net: the last propagated bits and the members released since.
+        self._bits = None
+        self._released = []
+
+    def name(self):
+        return "/".join(
+            "{}[{}]".format(self._netlist.pin_signal[a].name(), self._width)
+            for a in self._starts
+        )
+
+    def update(self):
+        nl = self._netlist
+        hiz = nl.hiz
+        value = nl.value
+        w = self._width
+
+        full = [a for a in self._nets[0]._drivers if hiz.find(1, a, a + w) < 0]
+        if self._driven != w * len(full):
+            # A member is only partly driven, so resolve each bit separately.
+            self._bits = None
+            self._released = []
+            for n in self._nets:
+                n._value = None
+                n.update()
+            return
 
-    # Merge this net with another (i.e. they share a pin in common).
-    def merge(self, n):
-        for p in n._pins:
-            self.append(p)
+        # Buses never have pull up/down, so a floating bus has nothing to propogate.
+        if not full:
+            return
+
+        self._scheduler.net_updates += 1
+
+        d = full[-1]
+        bits = value[d : d + w]
+        if bits == self._bits:
+            members = self._released
+        else:
+            members = range(len(self._starts))
+            self._bits = bits
+        self._released = []
+
+        edge = nl.edge
+        starts = self._starts
+        for m in members:
+            a = starts[m]
+            if not hiz[a]:
+                continue
+            sig = self._signals[m]
+            wake = self._wake[m]
+            old = value[a : a + w]
+            if old == bits:
+                continue
+            value[a : a + w] = bits
+            sig._cached = None
+            woken = False
+            for k in range(w):
+                if old[k] != bits[k]:
+                    edge[a + k] = bits[k]
+                    woken = woken or wake >> bits[k] & 1
+            if woken:
+                self._scheduler.component_changed(sig._target, sig)
 
 
 # Represents a single wire of a signal (conceptually a single pin of an IC).
 # Pins can be wired together into Nets.
 class Pin:
-    def __init__(self, name, signal):
-        self._name = name
+    __slots__ = (
+        "_signal",
+        "_net",
+        "_link",
+        "_nc",
+        "_netlist",
+        "_id",
+    )
+
+    def __init__(self, signal):
         self._signal = signal
         self._net = None
-        self._value = 0
-        self._hiz = True
-        self._edge = None
+        # Next pin in the same net (see Net).
+        self._link = None
         self._nc = False
+        # Index into the netlist's per-pin state tables.
+        self._netlist = signal._netlist
+        self._id = self._netlist.add_pin(self)
 
+    # Names aren't stored per pin, they're the signal name and bit index.
     def name(self):
-        return self._name
+        s = self._signal
+        return f"{s._name}_{self._id - s._ids[0]}"
 
     def fullname(self):
         return f"{self._signal._component.name()}:{self.name()}"
 
     def is_hiz(self):
-        return self._hiz
+        return self._netlist.hiz[self._id]
 
     def value(self):
-        return self._value
-
-    def update(self, v):
-        # Called when hi-z and something else on this net is driving this pin.
-        if v == self._value:
-            return
-        self._edge = v
-        self._value = v
-        self._signal.update()
+        return self._netlist.value[self._id]
 
     def had_edge(self, e):
-        result = self._edge == e
-        self._edge = None
+        edge = self._netlist.edge
+        result = edge[self._id] == e
+        edge[self._id] = -1
         return result
 
     def __ilshift__(self, v):
-        if not self._hiz and v == self._value:
-            return self
-        if self._hiz and v is None:
-            return self
+        nl = self._netlist
+        i = self._id
+        hiz = nl.hiz
+        n = self._net
+        if v is None:
+            if hiz[i]:
+                return self
+            # A released pin keeps its last value until something else drives the net.
+            hiz[i] = 1
+            if n:
+                n._drivers.pop(i, None)
+                b = n._target
+                if b is n:
+                    n._released.append(i)
+                else:
+                    b._driven -= 1
+                    b._bits = None
+        else:
+            value = nl.value
+            if v != value[i]:
+                value[i] = v
+                self._signal._cached = None
+            elif not hiz[i]:
+                return self
+            if hiz[i]:
+                hiz[i] = 0
+                if n:
+                    n._drivers[i] = None
+                    nl.scheduler.contention[n] = None
+                    b = n._target
+                    if b is not n:
+                        b._driven += 1
+                        b._bits = None
         # print(f'drive "{self.fullname()}" to {v}')
-        self._value = v
-        self._hiz = v is None
-        if self._net:
-            self._net.update()
+        if n:
+            nl.scheduler.net_changed(n)
         else:
             if not self._nc:
-                warn(f"Warning: driving unconnected pin {self.fullname()}", dedup=True)
+                nl.sim.warn(
+                    f"Warning: driving unconnected pin {self.fullname()}", dedup=True
+                )
         return self
 
     def __iadd__(self, other):
+        if self._netlist is not other._netlist:
+            raise Exception(
+                f"Can't connect pins from different simulations: {self.fullname()} and {other.fullname()}"
+            )
+        self._netlist.frozen = False
+        # Pins may still point at a net that has since been merged into another; that's
+        # resolved with Net._find and cleaned up by freeze().
         if self._net and other._net:
-            self._net.merge(other._net)
-            other._net = self._net
+            n = self._net.merge(other._net)
         elif self._net:
-            self._net.append(other)
-            other._net = self._net
+            n = self._net.append(other)
         elif other._net:
-            other._net.append(self)
-            self._net = other._net
+            n = other._net.append(self)
         else:
-            self._net = Net([self, other])
-            other._net = self._net
+            n = Net([self, other])
+        self._net = other._net = n
         return self
 
     def __add__(self, other):
@@ -171,7 +1431,9 @@ class Pin:
 
     def nc(self):
         if self._net:
-            warn("Warning: NC of a pin with a net: {}".format(self.fullname()))
+            self._netlist.sim.warn(
+                "Warning: NC of a pin with a net: {}".format(self.fullname())
+            )
         self._nc = True
 
 
@@ -179,10 +1441,19 @@ class Pin:
 # Typically a Signal's default SignalView will be used which contains all pins.
 # A SignalView is useful when individual lines from a bus need to be accessed.
 class SignalView:
+    __slots__ = (
+        "_signal",
+        "_pins",
+        "_max",
+        "_segments",
+    )
+
     def __init__(self, signal, pins):
         self._signal = signal
         self._pins = pins
         self._max = 2 ** len(self._pins)
+        # Set by freeze() on a signal's default view.
+        self._segments = None
 
     def name(self):
         if self == self._signal._view:
@@ -193,10 +1464,7 @@ class SignalView:
             )
 
     def __ilshift__(self, v):
-        if v is None:
-            for p in self._pins:
-                p <<= None
-        else:
+        if v is not None:
             v = int(v)
             if v < 0:
                 raise Exception("invalid value -- {} < 0 for {}".format(v, self.name()))
@@ -204,10 +1472,74 @@ class SignalView:
                 raise Exception(
                     "invalid value -- {} > {} for {}".format(v, self._max, self.name())
                 )
+        scheduler = self._signal._netlist.scheduler
+        if scheduler._running:
+            if scheduler._staged is None:
+                self._drive(v)
+            else:
+                scheduler.stage(self, v)
+        else:
+            # Commit every bit before the circuit settles.
+            scheduler.hold()
+            try:
+                self._drive(v)
+            finally:
+                scheduler.release()
+        return self
+
+    def _drive(self, v):
+        if self._segments is not None and self._signal._netlist.frozen:
+            self._drive_segments(v)
+        elif v is None:
+            for p in self._pins:
+                p <<= None
+        else:
             for p in self._pins:
                 p <<= v & 1
                 v >>= 1
-        return self
+
+    # Drive each bus segment of this view with a single slice write.
+    def _drive_segments(self, v):
+        nl = self._signal._netlist
+        hiz = nl.hiz
+        value = nl.value
+        for lo, w, a, bus in self._segments:
+            if bus is None:
+                self._pins[lo] <<= None if v is None else (v >> lo) & 1
+                continue
+            if v is None:
+                if hiz.find(0, a, a + w) < 0:
+                    continue
+                self._set_segment_hiz(bus, a, w, 1)
+            else:
+                bits = int_to_bits((v >> lo) & ((1 << w) - 1), w)
+                if value[a : a + w] != bits:
+                    value[a : a + w] = bits
+                    self._signal._cached = None
+                elif hiz.find(1, a, a + w) < 0:
+                    continue
+                self._set_segment_hiz(bus, a, w, 0)
+            nl.scheduler.net_changed(bus)
+
+    # Start or stop driving a whole bus segment, keeping the driver state of the bus
+    # and its per-bit nets up to date.
+    def _set_segment_hiz(self, bus, a, w, z):
+        nl = self._signal._netlist
+        hiz = nl.hiz
+        for k, n in enumerate(bus._nets):
+            i = a + k
+            if hiz[i] == z:
+                continue
+            if z:
+                del n._drivers[i]
+                bus._driven -= 1
+            else:
+                n._drivers[i] = None
+                nl.scheduler.contention[n] = None
+                bus._driven += 1
+        hiz[a : a + w] = bytes([z]) * w
+        if z:
+            bus._released.append(bus._members[a])
 
     def __iadd__(self, other):
         # print('connect', self.name(), other.name())
@@ -233,15 +1565,38 @@ class SignalView:
 # Represents a collection of pins on a component.
 # i.e. an 8-bit parallel input would be a signal containing 8 pins.
 class Signal:
+    __slots__ = (
+        "_pins",
+        "_name",
+        "_component",
+        "_wake",
+        "_target",
+        "_netlist",
+        "_ids",
+        "_cached",
+        "_view",
+        "_last_drive",
+        "_drive_fn",
+    )
+
     def __init__(self, component, name, width):
         self._pins = []
         self._name = name
         self._component = component
-        self._notify = False
+        # Which new pin values wake the component (bit 0: falling, bit 1: rising), and
+        # what the scheduler calls update() on when they do.
+        self._wake = 0
+        self._target = component
+        self._netlist = component._sim.netlist
         for i in range(width):
-            self._pins.append(Pin("{}_{}".format(name, i), self))
+            self._pins.append(Pin(self))
+        self._ids = [p._id for p in self._pins]
+        # Packed value of the pins, or None if a pin has changed since it was computed.
+        self._cached = None
         self._view = SignalView(self, self._pins)
         self._last_drive = None
+        # Set by Scheduler.install() to a generated function that drives this signal.
+        self._drive_fn = None
 
     def name(self):
         if len(self) == 1:
@@ -251,17 +1606,15 @@ class Signal:
                 self._component.name(), self._name, len(self) - 1
             )
 
-    def update(self):
-        if self._notify:
-            self._component.update(signal=self)
-
     def had_edge(self, i, v):
         return self._pins[i].had_edge(v)
 
     def value(self):
-        v = 0
-        for i in range(len(self._pins)):
-            v |= self._pins[i].value() << i
+        v = self._cached
+        if v is None:
+            # A signal's pins have contiguous ids.
+            a = self._ids[0]
+            v = self._cached = bits_to_int(self._netlist.value[a : a + len(self._ids)])
         return v
 
     def __ilshift__(self, v):
@@ -270,7 +1623,10 @@ class Signal:
             return self
         self._last_drive = v
 
-        self._view <<= v
+        if self._drive_fn is None:
+            self._view <<= v
+        else:
+            self._drive_fn(v)
         return self
 
     def __getitem__(self, i):
@@ -300,22 +1656,86 @@ class Signal:
 
 
 # A special case of Signal that notifies the parent component when updated.
+# `trigger` says which changes matter:
+#   "change"  - any pin changing (the default).
+#   "rising"  - a pin going from 0 to 1.
+#   "falling" - a pin going from 1 to 0.
+#   "level"   - any change, but only if the signal's value is different to what the
+#               handler last saw (i.e. ignoring pulses within a delta). Needs a handler.
+# By default the component's update(signal) is called. If a handler is given then
+# that's called (with no arguments) instead, independently of the component's other
+# signals, so a component can have a method per input.
 class NotifySignal(Signal):
-    def __init__(self, component, name, width):
+    __slots__ = (
+        "_trigger",
+        "_handler",
+        "_seen",
+        "_samples",
+    )
+
+    _WAKE = {"change": 3, "rising": 2, "falling": 1, "level": 3}
+
+    def __init__(self, component, name, width, trigger="change", handler=None):
         super().__init__(component, name, width)
-        self._notify = True
+        if trigger not in self._WAKE:
+            raise ValueError(f"Unknown trigger: {trigger}")
+        if trigger == "level" and handler is None:
+            raise ValueError(f"Level trigger without a handler: {name}")
+        self._wake = self._WAKE[trigger]
+        self._trigger = trigger
+        self._handler = handler
+        self._seen = None
+        # Whether the handler runs after the rest of the circuit has settled, see
+        # Scheduler.component_changed.
+        self._samples = handler is not None and trigger in ("rising", "falling")
+        if handler is not None:
+            self._target = self
+
+    # Called by the scheduler when this signal has its own handler.
+    def update(self, signal):
+        if self._trigger == "level":
+            v = self.value()
+            if v == self._seen:
+                return
+            self._seen = v
+        self._handler()
 
 
 class Component:
+    # See Scheduler.component_changed.
+    _samples = False
+
     def __init__(self, name):
         self._name = name
+        self._sim = simulation()
+        # Assigned by Netlist.freeze().
+        self._id = None
+        self._level = 0
+        self._log = self._sim._component_log_level(self)
 
     def name(self):
         return self._name
 
+    # Print a message if this component's log level allows it. Callers on hot paths
+    # should check self._log first so the arguments aren't evaluated either.
+    def debug(self, msg, *args, **kwargs):
+        if self._log >= DEBUG:
+            _log(msg, args, kwargs)
+
+    def trace(self, msg, *args, **kwargs):
+        if self._log >= TRACE:
+            _log(msg, args, kwargs)
+
     def update(self, signal):
         pass
 
+    # The inputs that each output depends on combinationally, as {output signal:
+    # input signals}, for levelizing and finding combinational loops. Outputs that
+    # aren't listed depend on all of the component's inputs. A registered output,
+    # which only changes on a clock edge, depends on none of them.
+    def combinational_paths(self):
+        return {}
+
     def reset(self):
         pass
 
@@ -336,11 +1756,11 @@ class Clock(Component):
 
     def tick(self):
         self.value = (self.value + 1) % (1 << len(self.clk))
-        debug("tick {}".format(self.value))
+        if self._log >= DEBUG:
+            self.debug("tick {}", self.value)
         self.clk <<= self.value
 
-        for n in all_nets:
-            n.check_drivers()
+        self._sim.scheduler.end_tick()
 
     def reset(self):
         self.value = 0
@@ -374,23 +1794,33 @@ class Counter(Component):
             self.v = (self.v + 1) % (1 << len(self.out))
             self.out <<= self.v
 
+    def combinational_paths(self):
+        return {self.out: ()}
+
 
 class Register(Component):
     def __init__(self, name, width=8):
         super().__init__(name)
         self.v = 0
         self.data = Signal(self, "data", width)
-        self.we = NotifySignal(self, "we", 1)
-        self.oe = NotifySignal(self, "oe", 1)
+        self.we = NotifySignal(self, "we", 1, trigger="rising", handler=self.on_we)
+        self.oe = NotifySignal(self, "oe", 1, trigger="level", handler=self.output)
         self.state = Signal(self, "state", width)
 
     def value(self):
         return self.v
 
-    def update(self, signal):
-        if self.we.had_edge(0, 1):
-            self.v = self.data.value()
-            trace("{} = 0x{:04x}".format(self.name(), self.v))
+    # The value is registered, but whether it's driven follows oe.
+    def combinational_paths(self):
+        return {self.data: (self.oe,), self.state: ()}
+
+    def on_we(self):
+        self.v = self.data.value()
+        if self._log >= TRACE:
+            self.trace("{} = 0x{:04x}", self.name(), self.v)
+        self.output()
+
+    def output(self):
         self.state <<= self.v
         if self.oe.value():
             self.data <<= self.v
@@ -404,17 +1834,23 @@ class IORegister(Component):
         self.v = 0
         self.inp = Signal(self, "inp", width)
         self.out = Signal(self, "out", width)
-        self.we = NotifySignal(self, "we", 1)
-        self.oe = NotifySignal(self, "oe", 1)
+        self.we = NotifySignal(self, "we", 1, trigger="rising", handler=self.on_we)
+        self.oe = NotifySignal(self, "oe", 1, trigger="level", handler=self.output)
         self.state = Signal(self, "state", width)
 
     def value(self):
         return self.v
 
-    def update(self, signal):
-        if self.we.had_edge(0, 1):
-            self.v = self.inp.value()
-            trace("{} = 0x{:04x}".format(self.name(), self.v))
+    def combinational_paths(self):
+        return {self.out: (self.oe,), self.state: ()}
+
+    def on_we(self):
+        self.v = self.inp.value()
+        if self._log >= TRACE:
+            self.trace("{} = 0x{:04x}", self.name(), self.v)
+        self.output()
+
+    def output(self):
         self.state <<= self.v
         if self.oe.value():
             self.out <<= self.v
@@ -425,14 +1861,25 @@ class IORegister(Component):
 class IncRegister(IORegister):
     def __init__(self, name, width=8):
         super().__init__(name, width)
-        self.inc = NotifySignal(self, "inc", 1)
+        # Carry is only high while inc is, so both edges matter.
+        self.inc = NotifySignal(self, "inc", 1, handler=self.on_inc)
         self.carry = Signal(self, "carry", 1)
 
-    def update(self, signal):
+    # Carry follows inc.
+    def combinational_paths(self):
+        paths = super().combinational_paths()
+        paths[self.carry] = (self.inc,)
+        return paths
+
+    def on_inc(self):
         if self.inc.had_edge(0, 1):
             self.v = (self.v + 1) & (2 ** len(self.inp) - 1)
-            trace("{} = 0x{:04x} (inc)".format(self.name(), self.v))
-        super().update(signal)
+            if self._log >= TRACE:
+                self.trace("{} = 0x{:04x} (inc)", self.name(), self.v)
+        self.output()
+
+    def output(self):
+        super().output()
         self.carry <<= self.v == 0 and self.inc.value() == 1
 
 
@@ -442,20 +1889,28 @@ class SplitRegister(Component):
         load_width = min(width, load_width)
         self.v = 0
         self.data = Signal(self, "data", width)
-        self.we = NotifySignal(self, "we", width // load_width)
-        self.oe = NotifySignal(self, "oe", 1)
+        self.we = NotifySignal(
+            self, "we", width // load_width, trigger="rising", handler=self.on_we
+        )
+        self.oe = NotifySignal(self, "oe", 1, trigger="level", handler=self.output)
         self.state = Signal(self, "state", width)
 
     def value(self):
         return self.v
 
-    def update(self, signal):
+    def combinational_paths(self):
+        return {self.data: (self.oe,), self.state: ()}
+
+    def on_we(self):
         load_width = len(self.data) // len(self.we)
         mask = (1 << load_width) - 1
         for i in range(len(self.we)):
             if self.we.had_edge(i, 1):
                 self.v = (self.v & ~mask) | (self.data.value() & mask)
             mask <<= load_width
+        self.output()
+
+    def output(self):
         self.state <<= self.v
         if self.oe.value():
             self.data <<= self.v
@@ -497,10 +1952,279 @@ class Multiplexer(Component):
         self.out <<= self.a.value() if self.sel.value() == 0 else self.b.value()
 
 
-class Rom(Component):
+# Storage for n words of data_width bits, all zero: a bytearray for up to 8 bits,
+# otherwise an array of the smallest unsigned type that fits.
+def new_words(n, data_width):
+    if data_width <= 8:
+        return bytearray(n)
+    for code in "HILQ":
+        size = array(code).itemsize
+        if size * 8 >= data_width:
+            return array(code, bytes(size * n))
+    raise ValueError(f"Unsupported data width: {data_width}")
+
+
+# Copy data (a bytes-like object, array or list of words) into words (from
+# new_words()) starting at base. Returns a view of the copied words.
+def copy_words(words, base, data):
+    end = base + len(data)
+    dst = memoryview(words)[base:end]
+    try:
+        src = memoryview(data)
+    except TypeError:
+        src = None
+    if src is not None and src.format == dst.format and src.ndim == 1:
+        dst[:] = src
+    else:
+        words[base:end] = array(dst.format, list(data))
+    return dst
+
+
+# A component that holds a block of memory, with bulk access to it. Subclasses
+# provide the storage through words().
+class Memory(Component, metaclass=abc.ABCMeta):
+    # The storage, e.g. `ram.ram`. Words can be read and written by index.
+    @abc.abstractmethod
+    def words(self):
+        pass
+
+    # Copy `data` (a bytes-like object, array or list of words) into memory starting
+    # at word `base`. Returns a view of the loaded words.
+    def load(self, data, base=0):
+        self._check_range(base, len(data))
+        return copy_words(self.words(), base, data)
+
+    def _check_range(self, base, n):
+        if base < 0 or base + n > len(self.words()):
+            raise ValueError(f"{n} words at 0x{base:x} don't fit in {self.name()}")
+
+    # A view of words start to end (exclusive), without copying them.
+    def dump(self, start=0, end=None):
+        return memoryview(self.words())[start:end]
+
+    # A copy of the contents, e.g. to pass to a later stdout() as `previous`.
+    def snapshot(self):
+        return bytes(self.words()[:])
+
+    # (first word, storage, the same words in `previous`) for each part of memory
+    # that might differ from `previous` (from snapshot()), in order.
+    def _compare(self, previous):
+        parts = []
+        for base, buf in self._buffers():
+            view = memoryview(buf)
+            size = view.itemsize
+            parts.append((base, buf, previous[base * size : (base + len(view)) * size]))
+        return parts
+
+    # (first word, storage) of each part of memory that might not be all zeros, in
+    # order. The storage is anything that supports the buffer protocol.
+    def _buffers(self):
+        words = self.words()
+        if isinstance(words, list):
+            words = copy_words(new_words(len(words), len(self.data)), 0, words).obj
+        return [(0, words)]
+
+    # One past the last non-zero word.
+    def _end(self):
+        for base, buf in reversed(self._buffers()):
+            view = memoryview(buf)
+            n = len(view.cast("B").tobytes().rstrip(b"\0"))
+            if n:
+                return base + -(-n // view.itemsize)
+        return 0
+
+    # Yields (address, words, previous words) for each row of 16 words (aligned to a
+    # multiple of 16) from start to end that isn't all zeros, or if `previous` (from
+    # snapshot()) is given, that has changed since. Rows are found by scanning the
+    # storage for non-zero bytes rather than by looking at every row.
+    def rows(self, start=0, end=None, previous=None):
+        if end is None:
+            end = len(self.words())
+        if previous is None:
+            parts = [(base, buf, None) for base, buf in self._buffers()]
+        else:
+            parts = self._compare(previous)
+        for base, buf, before in parts:
+            view = memoryview(buf)
+            size = view.itemsize
+            lo = max(start, base)
+            hi = min(end, base + len(view))
+            if lo >= hi:
+                continue
+            data = view.cast("B")[(lo - base) * size : (hi - base) * size].tobytes()
+            old = (
+                None
+                if before is None
+                else bytes(before[(lo - base) * size : (hi - base) * size])
+            )
+            pos = 0
+            while True:
+                k = _next_difference(data, old, pos * size)
+                if k < 0:
+                    break
+                i = lo + k // size
+                row = max(i & ~15, lo)
+                row_end = min((i & ~15) + 16, hi)
+                yield (
+                    row,
+                    view[row - base : row_end - base].tolist(),
+                    None
+                    if before is None
+                    else list(
+                        memoryview(
+                            before[(row - base) * size : (row_end - base) * size]
+                        ).cast(view.format)
+                    ),
+                )
+                pos = row_end - lo
+
+    # Print the rows that aren't all zeros, with "..." where rows were skipped. With
+    # `previous` (from snapshot()), prints only the rows that have changed since,
+    # before (-) and after (+).
+    def stdout(self, start=0, end=None, previous=None, file=None):
+        file = file or sys.stdout
+        file.write(f"{self.name().upper()}:\n")
+        pos = start
+        for addr, row, old in self.rows(start, end, previous):
+            if addr > pos and previous is None:
+                file.write("      ...\n")
+            pos = addr + len(row)
+            if old is None:
+                file.write(f"{addr:04x}: {_format_row(row)}\n")
+            else:
+                file.write(f"-{addr:04x}: {_format_row(old)}\n")
+                file.write(f"+{addr:04x}: {_format_row(row)}\n")
+
+    # Write words start to end (by default, to the last non-zero word) to a file as
+    # raw binary, with wider words in native byte order.
+    def save_binary(self, path, start=0, end=None):
+        if end is None:
+            end = self._end()
+        with open(path, "wb") as f:
+            f.write(self.words()[start:end])
+
+    # Load a raw binary image (as written by save_binary) at word `base`. The file is
+    # mapped rather than read, so this is a single copy into memory.
+    def load_binary(self, path, base=0):
+        word = memoryview(new_words(1, len(self.data)))
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size % word.itemsize:
+                raise ValueError(
+                    f"{path}: {size} bytes isn't a whole number of {word.itemsize}-byte "
+                    f"words ({len(self.data)}-bit data)"
+                )
+            if not size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                with memoryview(m) as v:
+                    with v.cast(word.format) as words:
+                        self.load(words, base)
+
+    # Write words start to end as Intel HEX. Rows of 16 zero bytes are left out, so
+    # this is only a complete image when loaded into zeroed memory.
+    def save_hex(self, path, start=0, end=None):
+        self._check_bytes()
+        if end is None:
+            end = self._end()
+        write_hex(path, [(a, bytes(row)) for a, row, _ in self.rows(start, end)])
+
+    def load_hex(self, path):
+        self._check_bytes()
+        for addr, data in read_hex(path):
+            self.load(data, addr)
+
+    def _check_bytes(self):
+        if len(self.data) > 8:
+            raise ValueError(f"Intel HEX needs 8-bit data: {self.name()}")
+
+
+_ZEROS = bytes(4096)
+
+
+# The index of the first byte from pos where data differs from old (or from zero if
+# old is None), or -1. Equal blocks are skipped with a single comparison, and the
+# first differing block is bisected, so this never looks at one byte at a time.
+def _next_difference(data, old, pos):
+    n = len(data)
+    while pos < n:
+        end = min(pos + len(_ZEROS), n)
+        ref = _ZEROS[: end - pos] if old is None else old[pos:end]
+        if data[pos:end] != ref:
+            a, b = pos, end
+            while b - a > 1:
+                mid = (a + b) // 2
+                if data[a:mid] == ref[a - pos : mid - pos]:
+                    a = mid
+                else:
+                    b = mid
+            return a
+        pos = end
+    return -1
+
+
+def _format_row(row):
+    return " ".join("{:02x}".format(b) for b in row)
+
+
+# Writes (address, bytes) records, e.g. from Memory.save_hex, as Intel HEX.
+def write_hex(path, records):
+    with open(path, "w") as f:
+        upper = 0
+        for addr, data in records:
+            for k in range(0, len(data), 16):
+                a = addr + k
+                row = data[k : k + 16]
+                if a >> 16 != upper:
+                    upper = a >> 16
+                    print(_hex_record(0, 4, upper.to_bytes(2, "big")), file=f)
+                # Split rows that cross a 64 KiB boundary.
+                n = min(len(row), 0x10000 - (a & 0xFFFF))
+                print(_hex_record(a & 0xFFFF, 0, row[:n]), file=f)
+                if n < len(row):
+                    upper += 1
+                    print(_hex_record(0, 4, upper.to_bytes(2, "big")), file=f)
+                    print(_hex_record(0, 0, row[n:]), file=f)
+        print(_hex_record(0, 1, b""), file=f)
+
+
+def _hex_record(addr, kind, data):
+    record = bytes([len(data), addr >> 8, addr & 0xFF, kind]) + bytes(data)
+    return ":{}{:02X}".format(record.hex().upper(), -sum(record) & 0xFF)
+
+
+# Reads the data records of an Intel HEX file, as a list of (address, bytes).
+def read_hex(path):
+    records = []
+    upper = 0
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith(":"):
+                raise Exception(f"{path}:{n}: not an Intel HEX record")
+            record = bytes.fromhex(line[1:])
+            if len(record) < 5 or len(record) != record[0] + 5 or sum(record) & 0xFF:
+                raise Exception(f"{path}:{n}: bad Intel HEX record")
+            addr = (record[1] << 8) | record[2]
+            kind = record[3]
+            data = record[4:-1]
+            if kind == 0:
+                records.append((upper + addr, data))
+            elif kind == 1:
+                break
+            elif kind == 2:
+                upper = int.from_bytes(data, "big") << 4
+            elif kind == 4:
+                upper = int.from_bytes(data, "big") << 16
+    return records
+
+
+class Rom(Memory):
     def __init__(self, addr_width=16, data_width=8):
         super().__init__("rom")
-        self.rom = [0] * (2 ** addr_width)
+        self.rom = new_words(2 ** addr_width, data_width)
         self.addr = NotifySignal(self, "addr", addr_width)
         self.data = Signal(self, "data", data_width)
         self.oe = NotifySignal(self, "oe", 1)
@@ -511,25 +2235,34 @@ class Rom(Component):
         else:
             self.data <<= None
 
+    def words(self):
+        return self.rom
 
-class Ram(Component):
+
+class Ram(Memory):
     def __init__(self, addr_width=16, data_width=8):
         super().__init__("ram")
-        self.ram = [0] * (2 ** addr_width)
-        self.addr = NotifySignal(self, "addr", addr_width)
+        self.ram = self._storage(2 ** addr_width, data_width)
+        self.addr = NotifySignal(self, "addr", addr_width, handler=self.output)
         self.data = Signal(self, "data", data_width)
-        self.we = NotifySignal(self, "we", 1)
-        self.oe = NotifySignal(self, "oe", 1)
+        self.we = NotifySignal(self, "we", 1, trigger="rising", handler=self.on_we)
+        self.oe = NotifySignal(self, "oe", 1, trigger="level", handler=self.output)
 
-    def update(self, signal):
-        if self.we.had_edge(0, 1):
-            trace(
-                "write: ram[0x{:04x}] = 0x{:02x}".format(
-                    self.addr.value(), self.data.value()
-                )
+    def _storage(self, n, data_width):
+        return new_words(n, data_width)
+
+    def words(self):
+        return self.ram
+
+    def on_we(self):
+        if self._log >= TRACE:
+            self.trace(
+                "write: ram[0x{:04x}] = 0x{:02x}", self.addr.value(), self.data.value()
             )
-            self.ram[self.addr.value()] = self.data.value()
+        self.ram[self.addr.value()] = self.data.value()
+        self.output()
 
+    def output(self):
         if self.oe.value():
             # print('read ram addr', hex(self.addr.value()))
             # print('RAM enabled')
@@ -539,30 +2272,170 @@ class Ram(Component):
             self.data <<= 0
             self.data <<= None
 
-    def stdout(self):
-        print("RAM:")
-        skip = False
-        for i in range(0, len(self.ram), 16):
-            if sum(self.ram[i : i + 16]) == 0:
-                skip = True
-                continue
-            if skip:
-                print("      ...")
-            skip = False
-            print(
-                "{:04x}: {}".format(
-                    i, " ".join("{:02x}".format(b) for b in self.ram[i : i + 16])
-                )
-            )
-
     def save(self, path):
-        n = len(self.ram) - 1
-        while self.ram[n] == 0:
-            n -= 1
+        n = max(self._end() - 1, 0)
         with open(path, "w") as f:
             print(bytearray(self.ram[0:n]), file=f)
 
 
+# Word storage for SparseRam that's allocated in pages on the first non-zero write
+# to each page. It can be indexed (and sliced) like a bytearray.
+class _Pages:
+    __slots__ = ("_len", "_data_width", "_shift", "_mask", "pages", "dirty")
+
+    def __init__(self, n, data_width, page_size):
+        if page_size < 1 or page_size & (page_size - 1):
+            raise ValueError(f"Page size must be a power of two: {page_size}")
+        self._len = n
+        self._data_width = data_width
+        self._shift = page_size.bit_length() - 1
+        self._mask = page_size - 1
+        # Page number -> words, for the allocated pages.
+        self.pages = {}
+        # Page numbers written since the last SparseRam.clean() (or snapshot()).
+        self.dirty = set()
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._slice(i)
+        if not 0 <= i < self._len:
+            i = range(self._len)[i]
+        page = self.pages.get(i >> self._shift)
+        return 0 if page is None else page[i & self._mask]
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            return self._set_slice(i, v)
+        if not 0 <= i < self._len:
+            i = range(self._len)[i]
+        page = self.page(i >> self._shift, v)
+        if page is not None:
+            page[i & self._mask] = v
+
+    # The words of page n, allocating it if `allocate` is true.
+    def page(self, n, allocate=True):
+        page = self.pages.get(n)
+        if page is None:
+            if not allocate:
+                return None
+            page = self.pages[n] = new_words(self._mask + 1, self._data_width)
+        self.dirty.add(n)
+        return page
+
+    def _slice(self, s):
+        start, stop, step = s.indices(self._len)
+        if step != 1:
+            return [self[i] for i in range(start, stop, step)]
+        words = new_words(max(stop - start, 0), self._data_width)
+        for n in range(start >> self._shift, ((stop - 1) >> self._shift) + 1):
+            page = self.pages.get(n)
+            if page is None:
+                continue
+            a = max(start, n << self._shift)
+            b = min(stop, (n + 1) << self._shift)
+            words[a - start : b - start] = page[
+                a & self._mask : (b - 1 & self._mask) + 1
+            ]
+        return words
+
+    # Assign words (a bytes-like object, array or list) to a slice of the same
+    # length. Pages are only allocated for non-zero words.
+    def _set_slice(self, s, data):
+        start, stop, step = s.indices(self._len)
+        indices = range(start, stop, step)
+        if len(data) != len(indices):
+            raise ValueError(
+                f"Can't assign {len(data)} words to a slice of {len(indices)}"
+            )
+        if step != 1:
+            for i, v in zip(indices, data):
+                self[i] = v
+            return
+        pos = start
+        while pos < stop:
+            lo = pos & self._mask
+            k = min(self._mask + 1 - lo, stop - pos)
+            chunk = data[pos - start : pos - start + k]
+            page = self.page(pos >> self._shift, any(chunk))
+            if page is not None:
+                copy_words(page, lo, chunk)
+            pos += k
+
+
+# A Ram that only allocates memory for the pages (of page_size words) that have
+# been written with something other than zero, for a large address space of which
+# a program only uses a few pages. Reads from other pages give zero, and stdout(),
+# save() and snapshot() skip them. `ram.ram` is indexed (and sliced) as for Ram.
+#
+# Pages written to are marked dirty until the next clean() or snapshot(), so a
+# snapshot only copies the pages written since the one before, and comparing with
+# the latest snapshot (e.g. stdout(previous=...)) only looks at those pages.
+class SparseRam(Ram):
+    def __init__(self, addr_width=16, data_width=8, page_size=0x1000):
+        self.page_size = page_size
+        super().__init__(addr_width, data_width)
+        # The snapshot taken at the last clean(), if it was taken by snapshot().
+        self._clean_snapshot = None
+
+    def _storage(self, n, data_width):
+        return _Pages(n, data_width, self.page_size)
+
+    def _buffers(self):
+        return [(n * self.page_size, self.ram.pages[n]) for n in sorted(self.ram.pages)]
+
+    # Page numbers written to since the last clean() or snapshot().
+    def dirty_pages(self):
+        return sorted(self.ram.dirty)
+
+    def clean(self):
+        self.ram.dirty.clear()
+        self._clean_snapshot = None
+
+    def load(self, data, base=0):
+        self._check_range(base, len(data))
+        end = base + len(data)
+        self.ram[base:end] = data
+        return self.dump(base, end)
+
+    # A copy of the allocated pages only, as {page number: bytes}. Pages that
+    # haven't been written since the last snapshot are shared with it (bytes are
+    # immutable) rather than copied again.
+    def snapshot(self):
+        last = self._clean_snapshot or {}
+        dirty = self.ram.dirty
+        snapshot = {
+            n: last[n] if n in last and n not in dirty else bytes(page)
+            for n, page in self.ram.pages.items()
+        }
+        self.clean()
+        self._clean_snapshot = snapshot
+        return snapshot
+
+    def _compare(self, previous):
+        zeros = new_words(self.page_size, len(self.data))
+        if previous is self._clean_snapshot:
+            # Only the dirty pages can differ from it.
+            pages = sorted(self.ram.dirty)
+        else:
+            pages = sorted(self.ram.pages.keys() | previous.keys())
+        parts = []
+        for n in pages:
+            page = self.ram.pages.get(n, zeros)
+            old = previous.get(n)
+            parts.append(
+                (n * self.page_size, page, bytes(zeros) if old is None else old)
+            )
+        return parts
+
+    # A copy (rather than a view) of words start to end, as the pages aren't
+    # contiguous.
+    def dump(self, start=0, end=None):
+        return memoryview(self.ram[start:end])
+
+
 class PagedRamController(Component):
     def __init__(self, addr_width=13, num_pages=2, reg_base_addr=None, data_width=8):
         super().__init__("paged_ram")
@@ -574,20 +2447,22 @@ class PagedRamController(Component):
         else:
             self.reg_base_addr = reg_base_addr
         self.num_pages = num_pages
-        self.in_addr = NotifySignal(self, "in_addr", addr_width)
+        self.in_addr = NotifySignal(self, "in_addr", addr_width, handler=self.output)
         self.out_addr = Signal(self, "out_addr", data_width)
         self.data = Signal(self, "data", data_width)
-        self.we = NotifySignal(self, "we", 1)
-        self.z = NotifySignal(self, "z", 1)
+        self.we = NotifySignal(self, "we", 1, trigger="rising", handler=self.on_we)
+        self.z = Signal(self, "z", 1)
         self.pages = [0] * num_pages
 
-    def update(self, signal):
-        if self.we.had_edge(0, 1):
-            page = self.in_addr.value() - self.reg_base_addr
-            if page >= 0 and page < self.num_pages:
-                trace("Page {} = {:02x}".format(page, self.data.value()))
-                self.pages[page] = self.data.value()
+    def on_we(self):
+        page = self.in_addr.value() - self.reg_base_addr
+        if page >= 0 and page < self.num_pages:
+            if self._log >= TRACE:
+                self.trace("Page {} = {:02x}", page, self.data.value())
+            self.pages[page] = self.data.value()
+        self.output()
 
+    def output(self):
         v = self.pages[self.in_addr.value() >> (self.addr_width - self.page_width)]
         self.out_addr <<= v
         self.z <<= v == 0
@@ -620,6 +2495,10 @@ class MemoryDevice(Component):
         self.we_out = NotifySignal(self, "we_out", 1)
         self.trigger = 0
 
+    # oe_out and we_out are outputs, passing oe and we on to the next device.
+    def combinational_paths(self):
+        return {self.oe_out: (self.addr, self.oe), self.we_out: (self.addr, self.we)}
+
     def on_write(self, offset, v):
         pass
 
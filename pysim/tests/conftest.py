@@ -0,0 +1,46 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The simulator modules are imported as top-level modules (e.g. `from sim import *`),
+# as they are when running the CPUs from the pysim directory.
+PYSIM = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYSIM)
+
+from sim import Clock, Simulation
+
+
+# Runs a CPU's main() on a test program in a new Simulation, returning its output.
+# `setup` is called with the simulation first, e.g. to change the scheduler mode.
+# With `cycles`, the run is interrupted (as with Ctrl-C) after that many clock ticks,
+# for programs that don't halt.
+@pytest.fixture
+def run_cpu(capsys, monkeypatch):
+    limit = {"cycles": None, "ticks": 0}
+    tick = Clock.tick
+
+    def limited(clock):
+        limit["ticks"] += 1
+        if limit["cycles"] is not None and limit["ticks"] > limit["cycles"]:
+            raise KeyboardInterrupt()
+        tick(clock)
+
+    monkeypatch.setattr(Clock, "tick", limited)
+
+    def run(cpu, program, *args, setup=None, cycles=None):
+        # The assemblers load their grammars relative to the pysim directory.
+        monkeypatch.chdir(PYSIM)
+        module = importlib.import_module(f"{cpu}.cpu")
+        monkeypatch.setattr(sys, "argv", ["cpu", f"{cpu}/tests/{program}", *args])
+        limit["cycles"] = cycles
+        limit["ticks"] = 0
+        capsys.readouterr()
+        with Simulation() as sim:
+            if setup is not None:
+                setup(sim)
+            module.main()
+        return capsys.readouterr().out
+
+    return run
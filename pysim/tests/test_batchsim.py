@@ -0,0 +1,139 @@
+import re
+
+import pytest
+
+from sim import *
+
+np = pytest.importorskip("numpy")
+
+from batchsim import BatchSimulation
+from shared import SharedRam
+
+
+def build():
+    clk = Clock(1)
+    power = Power()
+    counter = Counter(4)
+    reg = IORegister("reg", width=4)
+    mux = Multiplexer("mux", width=4)
+    counter.clk += clk.clk
+    reg.inp += counter.out
+    reg.we += counter.out[1]
+    reg.oe += power.high
+    mux.a += counter.out
+    mux.b += reg.out
+    mux.sel += counter.out[3]
+    for c in (clk, power, counter, reg, mux):
+        c.reset()
+    return clk, mux
+
+
+def test_batch_matches_scalar():
+    with Simulation():
+        clk, mux = build()
+        scalar = []
+        for _ in range(40):
+            clk.tick()
+            scalar.append(mux.out.value())
+
+    with Simulation():
+        clk, mux = build()
+        bs = BatchSimulation(clk, 3)
+        batch = []
+        for _ in range(40):
+            bs.tick()
+            batch.append(bs.value(mux.out))
+
+    for k in range(3):
+        assert [int(v[k]) for v in batch] == scalar
+
+
+# The output of a cpu_a_6 run without the lines that differ between the scalar and
+# batched runs: the summary, and warnings about pins only the scalar run drives.
+def program_output(out):
+    lines = []
+    for line in out.splitlines():
+        if line.startswith(("Ran ", "Warning: driving unconnected pin")):
+            continue
+        lines.append(line)
+    return lines
+
+
+@pytest.mark.parametrize("program", ["count.s", "mem.s"])
+def test_cpu_a_6_batch_matches_scalar(run_cpu, program):
+    scalar = run_cpu("cpu_a_6", program)
+    batch = run_cpu("cpu_a_6", program, "--batch", "4")
+    assert "(identical results)" in batch
+    cycles = re.search(r"Ran for (\d+) cycles", scalar).group(1)
+    assert f"Ran 4 instances for {cycles} cycles" in batch
+    assert program_output(batch) == program_output(scalar)
+
+
+# A counter addressing `ram`, which is read into a register on each clock edge.
+def build_ram(ram):
+    clk = Clock(1)
+    power = Power()
+    counter = Counter(4)
+    reg = IORegister("reg", width=8)
+    counter.clk += clk.clk
+    ram.addr += counter.out
+    ram.oe += power.high
+    ram.we += power.low
+    reg.inp += ram.data
+    reg.we += clk.clk
+    reg.oe += power.high
+    for c in (clk, power, counter, ram, reg):
+        c.reset()
+    return clk, reg
+
+
+def run_ram(ram, n=None):
+    ram.load(bytes(range(3, 19)))
+    clk, reg = build_ram(ram)
+    values = []
+    if n is None:
+        for _ in range(20):
+            clk.tick()
+            values.append(reg.out.value())
+        return values
+    bs = BatchSimulation(clk, n)
+    for _ in range(20):
+        bs.tick()
+        values.append([int(v) for v in bs.value(reg.out)])
+    return values
+
+
+# The register latches the RAM's data for the counter's new address, as it only
+# samples it once the rest of the circuit has settled.
+def test_batch_samples_after_settling():
+    with Simulation():
+        scalar = run_ram(Ram(addr_width=4))
+    with Simulation():
+        batch = run_ram(Ram(addr_width=4), 2)
+    assert scalar[:4] == [4, 4, 5, 5]
+    assert batch == [[v, v] for v in scalar]
+
+
+class LoggingRam(Ram):
+    def output(self):
+        print("read", self.addr.value())
+        super().output()
+
+
+# Subclasses use their base class's implementation, unless they change what it
+# does.
+def test_batch_subclass(tmp_path):
+    with Simulation():
+        scalar = run_ram(Ram(addr_width=4))
+    with Simulation():
+        sparse = run_ram(SparseRam(addr_width=4, page_size=4), 2)
+    assert sparse == [[v, v] for v in scalar]
+    with Simulation():
+        ram = SharedRam(addr_width=4, path=str(tmp_path / "state"))
+        shared = run_ram(ram, 2)
+        ram.close()
+    assert shared == [[v, v] for v in scalar]
+
+    with Simulation():
+        with pytest.raises(Exception, match="No batched implementation of LoggingRam"):
+            run_ram(LoggingRam(addr_width=4), 2)
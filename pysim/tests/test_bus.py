@@ -0,0 +1,119 @@
+import pytest
+
+from sim import *
+
+
+# Records the value of its input every time it's updated.
+class Recorder(Component):
+    def __init__(self, width=8):
+        super().__init__("recorder")
+        self.inp = NotifySignal(self, "inp", width)
+        self.seen = []
+
+    def update(self, signal):
+        self.seen.append(self.inp.value())
+
+
+def driver(name, width):
+    return Signal(Component(name), "out", width)
+
+
+def test_full_width_bus():
+    with Simulation() as sim:
+        out = driver("driver", 8)
+        rec = Recorder()
+        out += rec.inp
+        sim.freeze()
+        assert [b._width for b in sim.netlist.buses] == [8]
+
+        out <<= 0xA5
+        out <<= 0x5A
+        assert rec.seen == [0xA5, 0x5A]
+
+
+# Each slice of the input connects bit-for-bit to a different signal, so each is
+# a bus of its own.
+def test_partial_width_buses():
+    with Simulation() as sim:
+        lo = driver("lo", 4)
+        hi = driver("hi", 4)
+        rec = Recorder()
+        rec.inp[0:4] += lo
+        rec.inp[4:8] += hi
+        sim.freeze()
+        assert sorted(b._width for b in sim.netlist.buses) == [4, 4]
+
+        lo <<= 0xF
+        hi <<= 0x3
+        with sim.batch():
+            lo <<= 0x1
+            hi <<= 0x2
+        assert rec.seen == [0x0F, 0x3F, 0x21]
+
+
+def test_slice_drive():
+    with Simulation() as sim:
+        out = driver("driver", 8)
+        rec = Recorder()
+        out += rec.inp
+        out <<= 0
+        out[2:6] <<= 0xF
+        assert rec.seen == [0x3C]
+
+
+# Without a bus (the bits are crossed over), a multi-bit drive is still committed
+# in full before the reader is woken, so it never sees a half-written value.
+@pytest.mark.parametrize("mode", ["delta", "levelized"])
+def test_drive_is_atomic(mode):
+    with Simulation() as sim:
+        sim.set_mode(mode)
+        out = driver("driver", 8)
+        rec = Recorder()
+        for i in range(8):
+            rec.inp[i] += out[7 - i]
+        sim.freeze()
+        assert sim.netlist.buses == []
+
+        out <<= 0x0F
+        out <<= 0xF0
+        assert rec.seen == [0xF0, 0x0F]
+
+
+def contention(sim):
+    return {m for m in sim.warn_messages if "Multiple drivers" in m}
+
+
+# Two drivers fight over a net from the second tick on. The check after each
+# tick warns about it (it doesn't raise), as configured.
+@pytest.mark.parametrize(
+    "mode,every,warned", [("always", 1, 2), ("sampled", 3, 3), ("off", 1, None)]
+)
+def test_contention_check(mode, every, warned):
+    with Simulation() as sim:
+        sim.set_contention_check(mode, every)
+        clk = Clock(1)
+        a = driver("a", 1)
+        b = driver("b", 1)
+        a += b
+        clk.reset()
+        a <<= 1
+        first = None
+        for tick in range(1, 5):
+            if tick == 2:
+                b <<= 0
+            clk.tick()
+            if first is None and contention(sim):
+                first = tick
+        assert first == warned
+        if warned:
+            assert contention(sim) == {
+                "Warning: Multiple drivers on a:out_0/b:out_0: a:out_0 b:out_0"
+            }
+
+
+def test_bad_contention_check():
+    with Simulation() as sim:
+        with pytest.raises(ValueError):
+            sim.set_contention_check("never")
+        with pytest.raises(ValueError):
+            sim.set_contention_check("sampled", every=0)
@@ -0,0 +1,61 @@
+import os
+
+from sim import *
+from codegen import compile_netlist
+
+
+def test_compiled_matches_generic(run_cpu, tmp_path, monkeypatch):
+    monkeypatch.setenv("PYSIM_CACHE", str(tmp_path))
+    generic = run_cpu("cpu_ax_13", "primes2.s", cycles=2000)
+    compiled = run_cpu("cpu_ax_13", "primes2.s", "--compile", cycles=2000)
+    assert len(os.listdir(tmp_path)) == 1
+    assert "Ran for 2000 cycles" in compiled
+    assert compiled == generic
+
+
+def test_compiled_run_halts(run_cpu, tmp_path, monkeypatch):
+    monkeypatch.setenv("PYSIM_CACHE", str(tmp_path))
+    generic = run_cpu("cpu_ax_13", "hlt.s")
+    compiled = run_cpu("cpu_ax_13", "hlt.s", "--compile", cycles=1000)
+    assert "Ran for 24 cycles" in compiled
+    assert compiled == generic
+
+
+def counter_circuit(width):
+    clk = Clock(1)
+    counter = Counter(width)
+    counter.clk += clk.clk
+    clk.reset()
+    counter.reset()
+    return clk, counter
+
+
+def test_cache(tmp_path):
+    with Simulation():
+        clk, counter = counter_circuit(4)
+        step = compile_netlist(clk, cache_dir=str(tmp_path))
+        for _ in range(6):
+            step()
+        assert counter.out.value() == 3
+    (path,) = tmp_path.iterdir()
+    generated = path.stat().st_mtime_ns
+
+    # The same circuit reuses the generated module.
+    with Simulation():
+        clk, counter = counter_circuit(4)
+        compile_netlist(clk, cache_dir=str(tmp_path))
+    assert list(tmp_path.iterdir()) == [path]
+    assert path.stat().st_mtime_ns == generated
+
+    # A different one generates another, as does a new connection after compiling.
+    with Simulation():
+        clk, counter = counter_circuit(5)
+        step = compile_netlist(clk, cache_dir=str(tmp_path))
+        assert len(list(tmp_path.iterdir())) == 2
+        mux = Multiplexer("mux", width=5)
+        mux.a += counter.out
+        step = compile_netlist(clk, cache_dir=str(tmp_path))
+        assert len(list(tmp_path.iterdir())) == 3
+        for _ in range(6):
+            step()
+        assert mux.out.value() == 3
@@ -0,0 +1,53 @@
+import pytest
+
+
+# The RAM that the original recursive simulator leaves after 4000 cycles of each
+# program. The first instruction is fetched in the same decoder state that the RAM's
+# output is enabled in, so this checks that the instruction register latches the
+# RAM's data rather than what was on the bus before.
+EXPECTED = {
+    "primes.s": """\
+RAM:
+0000: 0f fe 2f fd 40 7b 0f fe 2f d3 40 7c 0f fe 2f fe
+0010: 4f fc 0f fe 20 7a 4f fb 0f fe 2f f9 0f d2 e0 22
+0020: 60 18 0f fe 2f f9 0f d2 e0 22 0f fe 2f fe 2f fe
+0030: 40 7b 0f fe 20 7c 20 7b 60 3c 60 36 0f fd 20 7b
+0040: 0f fd 2f fe 60 6e 0f fe 20 7b 2f fe 40 7b 20 7c
+0050: 2f fe 60 56 60 32 0f fe 20 7c 4f fb 0f fe 2f f9
+0060: 0f d2 e0 66 60 5c 0f fe 2f f9 0f d2 e0 66 0f fe
+0070: 20 7c 20 7a 40 7c 60 2a 60 2a 02 00 03 00 00 00
+      ...
+0fd0: 00 00 fe 03 00 00 00 00 00 00 00 00 00 00 00 00
+      ...
+0ff0: 00 00 00 00 00 00 00 00 00 00 00 00 00 00 ff 01
+""",
+    "primes2.s": """\
+RAM:
+0000: 0f fe 2f fd 40 96 0f fe 2f d3 40 97 0f fe 2f fe
+0010: 4f fc 0f fe 2f d2 4f fb 0f fe 2f f9 0f d1 e0 22
+0020: 60 18 0f fe 2f f9 0f d1 e0 22 0f fe 2f d2 40 96
+0030: 0f fe 20 97 0f fd 20 96 0f fd 60 34 20 96 e0 42
+0040: 60 8a 0f fe 20 96 0f fd 2f d2 0f fd e0 50 60 5a
+0050: 0f fe 20 96 2f d2 60 60 60 60 0f fe 20 96 2f ff
+0060: 40 96 0f fe 20 96 20 96 0f fd 20 97 0f fd 60 72
+0070: 60 30 0f fe 20 97 4f fb 0f fe 2f f9 0f d1 e0 82
+0080: 60 78 0f fe 2f f9 0f d1 e0 82 0f fe 20 97 2f d2
+0090: 40 97 60 2a 60 2a 00 03 00 00 00 00 00 00 00 00
+      ...
+0fd0: 00 fe 02 03 00 00 00 00 00 00 00 00 00 00 00 00
+      ...
+0ff0: 00 00 00 00 00 00 00 00 00 00 00 00 00 00 ff 01
+""",
+}
+
+
+# The RAM dump that the CPU prints after it stops.
+def final_ram(out):
+    return out[out.rindex("RAM:\n") :]
+
+
+@pytest.mark.parametrize("program", sorted(EXPECTED))
+def test_cpu_ax_13_matches_original_simulator(run_cpu, program):
+    out = run_cpu("cpu_ax_13", program, cycles=4000)
+    assert "Ran for 4000 cycles" in out
+    assert final_ram(out) == EXPECTED[program]
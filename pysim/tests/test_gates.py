@@ -0,0 +1,101 @@
+import pytest
+
+from sim import Component, Signal, Simulation
+from gates import And, Gate, Not, Or, PackedCircuit, Xor
+
+
+def test_gate_needs_eval():
+    with Simulation():
+        with pytest.raises(TypeError):
+            Gate("gate")
+
+
+def test_gates():
+    with Simulation():
+        driver = Component("driver")
+        inp = Signal(driver, "inp", 2)
+        a = And("and", 2)
+        n = Not("not")
+        inp += a.inp
+        a.out += n.inp
+        a.reset()
+        n.reset()
+        for x in range(4):
+            inp <<= x
+            assert a.out.value() == (x == 3)
+            assert n.out.value() == (x != 3)
+
+
+# A 2-bit adder with carry in, made of gates.
+def adder():
+    src = Component("src")
+    a = Signal(src, "a", 2)
+    b = Signal(src, "b", 2)
+    cin = Signal(src, "cin", 1)
+    dst = Component("dst")
+    out = Signal(dst, "out", 3)
+    gates = []
+    carry = cin
+    for i in range(2):
+        x1 = Xor(f"x1_{i}")
+        x2 = Xor(f"x2_{i}")
+        a1 = And(f"a1_{i}")
+        a2 = And(f"a2_{i}")
+        c = Or(f"c_{i}")
+        x1.inp[0] += a[i] + a1.inp[0]
+        x1.inp[1] += b[i] + a1.inp[1]
+        x2.inp[0] += x1.out + a2.inp[0]
+        x2.inp[1] += carry + a2.inp[1]
+        c.inp[0] += a1.out
+        c.inp[1] += a2.out
+        out[i] += x2.out
+        carry = c.out
+        gates += [x1, x2, a1, a2, c]
+    out[2] += carry
+    return (a, b, cin), out, gates
+
+
+def test_packed_matches_scalar():
+    with Simulation():
+        (a, b, cin), out, gates = adder()
+        for g in gates:
+            g.reset()
+        # The truth table, from the gates in the event-driven simulator.
+        table = {}
+        for x in range(32):
+            a <<= x & 3
+            b <<= (x >> 2) & 3
+            cin <<= x >> 4
+            table[(x & 3, (x >> 2) & 3, x >> 4)] = out.value()
+        assert table[(3, 2, 1)] == 6
+
+        packed = PackedCircuit([a, b, cin], [out], lanes=4)
+        assert packed.exhaustive(lambda a, b, cin: {"out": table[(a, b, cin)]}) == []
+        # Eight batches of four vectors.
+        assert packed.evaluations == 8
+
+        # Mismatches are reported with their inputs.
+        failures = packed.exhaustive(lambda a, b, cin: {"out": a + b})
+        assert len(failures) == 16
+        assert ({"a": 3, "b": 2, "cin": 1}, {"out": 6}, {"out": 5}) in failures
+
+        vectors = [{a: 1, b: 3, cin: 0}, {a: 3, b: 3, cin: 1}]
+        assert packed.run(vectors) == [{out: 4}, {out: 7}]
+
+
+def test_packed_loop():
+    with Simulation():
+        src = Component("src")
+        inp = Signal(src, "inp", 1)
+        dst = Component("dst")
+        out = Signal(dst, "out", 1)
+        a = And("and")
+        n1 = Not("n1")
+        n2 = Not("n2")
+        a.inp[0] += inp
+        a.inp[1] += n2.out
+        n1.inp += a.out
+        n2.inp += n1.out
+        out += n2.out
+        with pytest.raises(Exception, match="Combinational loop through and, n1, n2"):
+            PackedCircuit([inp], [out])
@@ -0,0 +1,58 @@
+from sim import *
+
+
+# A counter clocked through a multiplexer that its own output switches.
+def counter_feedback():
+    counter = Counter(1)
+    mux = Multiplexer("mux", width=1)
+    mux.sel += counter.out
+    counter.clk += mux.out
+    return counter, mux
+
+
+def test_registered_output_is_not_a_loop():
+    with Simulation() as sim:
+        sim.set_mode("levelized")
+        counter, mux = counter_feedback()
+        sim.freeze()
+        assert sim.combinational_loops() == []
+        # The counter's output doesn't depend on its clock, so the multiplexer comes
+        # first.
+        assert mux._level < counter._level
+        assert sim.warn_messages == set()
+
+
+def test_unlisted_outputs_depend_on_every_input():
+    with Simulation() as sim:
+        a = Multiplexer("a", width=2)
+        b = Multiplexer("b", width=2)
+        a.out += b.a
+        b.out += a.a
+        sim.freeze()
+        loops = sim.combinational_loops()
+        assert len(loops) == 1
+        components, nets = loops[0]
+        assert components == [a, b]
+        assert len(nets) == 4
+
+
+def test_loop_through_enable():
+    # A register's value is registered but whether it's driven follows oe, so a
+    # register that enables itself through another component is still a loop.
+    with Simulation() as sim:
+        reg = Register("reg", width=1)
+        mux = Multiplexer("mux", width=1)
+        mux.a += reg.data
+        mux.out += reg.oe
+        sim.freeze()
+        loops = sim.combinational_loops()
+        assert [c for c in loops[0][0]] == [reg, mux]
+
+
+def test_cpu_ah_16_levelized_matches_delta(run_cpu):
+    delta = run_cpu("cpu_ah_16", "test.s")
+    levelized = run_cpu(
+        "cpu_ah_16", "test.s", setup=lambda sim: sim.set_mode("levelized")
+    )
+    assert "combinational loop" not in levelized
+    assert levelized == delta
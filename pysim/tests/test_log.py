@@ -0,0 +1,74 @@
+import pytest
+
+from sim import *
+
+
+# Logs at both levels whenever its input changes.
+class Chatty(Component):
+    def __init__(self, name):
+        super().__init__(name)
+        self.inp = NotifySignal(self, "inp", 1)
+
+    def update(self, signal):
+        self.debug("{} debug", self.name())
+        self.trace("{} trace", self.name())
+
+
+class Chattier(Chatty):
+    pass
+
+
+# Fails if it's ever formatted.
+class Unformattable:
+    def __format__(self, spec):
+        raise AssertionError("formatted a disabled message")
+
+
+def log(capsys, out):
+    capsys.readouterr()
+    out <<= 1 - out.value()
+    return capsys.readouterr().out.splitlines()
+
+
+def test_log_levels(capsys):
+    with Simulation() as sim:
+        out = Signal(Component("driver"), "out", 1)
+        a = Chatty("a")
+        b = Chatty("b")
+        # Set for a class before any of it exists.
+        sim.set_log_level("trace", Chattier)
+        c = Chattier("c")
+        out += a.inp + b.inp + c.inp
+        out <<= 0
+
+        assert log(capsys, out) == ["c debug", "c trace"]
+
+        sim.set_log_level("debug")
+        assert log(capsys, out) == ["a debug", "b debug", "c debug", "c trace"]
+
+        # A component's own level beats its class's and the default.
+        sim.set_log_level("off", a)
+        sim.set_log_level("off", c)
+        assert log(capsys, out) == ["b debug"]
+
+        sim.set_log_level("trace", b)
+        sim.set_log_level("off")
+        assert log(capsys, out) == ["b debug", "b trace"]
+
+
+def test_disabled_messages_arent_formatted(capsys):
+    with Simulation() as sim:
+        c = Chatty("c")
+        c.debug("{}", Unformattable())
+        c.trace("{}", Unformattable())
+        trace("{}", Unformattable())
+        sim.set_log_level("debug")
+        c.trace("{}", Unformattable())
+        c.debug("{} {}", "shown", 1)
+        assert capsys.readouterr().out == "shown 1\n"
+
+
+def test_bad_log_level():
+    with Simulation() as sim:
+        with pytest.raises(ValueError):
+            sim.set_log_level("verbose")
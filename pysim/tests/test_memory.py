@@ -0,0 +1,234 @@
+import pytest
+
+from sim import *
+
+
+def test_memory_needs_storage():
+    with Simulation():
+        with pytest.raises(TypeError):
+            Memory("memory")
+
+
+@pytest.mark.parametrize("data_width", [8, 16, 32])
+def test_ram_load_dump(data_width):
+    with Simulation():
+        ram = Ram(addr_width=8, data_width=data_width)
+        view = ram.load([1, 2, 3, (1 << data_width) - 1], base=0x10)
+        assert list(view) == [1, 2, 3, (1 << data_width) - 1]
+        assert ram.ram[0x13] == (1 << data_width) - 1
+        assert list(ram.dump(0x0F, 0x15)) == [0, 1, 2, 3, (1 << data_width) - 1, 0]
+        with pytest.raises(ValueError):
+            ram.load(bytes(2), base=0xFF)
+
+
+def test_ram_read_write():
+    with Simulation() as sim:
+        ram = Ram(addr_width=4)
+        driver = Component("driver")
+        addr = Signal(driver, "addr", 4)
+        data = Signal(driver, "data", 8)
+        we = Signal(driver, "we", 1)
+        oe = Signal(driver, "oe", 1)
+        ram.addr += addr
+        ram.data += data
+        ram.we += we
+        ram.oe += oe
+        with sim.batch():
+            addr <<= 5
+            data <<= 0x42
+            we <<= 0
+            oe <<= 0
+        we <<= 1
+        assert ram.ram[5] == 0x42
+        with sim.batch():
+            data <<= None
+            we <<= 0
+            oe <<= 1
+            addr <<= 6
+        assert data.value() == 0
+        addr <<= 5
+        assert data.value() == 0x42
+
+
+# Page registers at 0x0E and 0x0F select the page for each half of a 16-word
+# address space, and `z` says whether the current page is page zero.
+def test_paged_ram_controller():
+    with Simulation() as sim:
+        ctrl = PagedRamController(
+            addr_width=4, num_pages=2, reg_base_addr=0x0E, data_width=4
+        )
+        driver = Component("driver")
+        addr = Signal(driver, "addr", 4)
+        data = Signal(driver, "data", 4)
+        we = Signal(driver, "we", 1)
+        # `z` is an output, not a NotifySignal.
+        flag = Signal(Component("reader"), "z", 1)
+        ctrl.in_addr += addr
+        ctrl.data += data
+        ctrl.we += we
+        ctrl.z += flag
+        assert type(ctrl.z) is Signal
+        with sim.batch():
+            addr <<= 0x0F
+            data <<= 3
+            we <<= 0
+        we <<= 1
+        we <<= 0
+        assert ctrl.pages == [0, 3]
+        addr <<= 0x02
+        assert (ctrl.out_addr.value(), flag.value()) == (0, 1)
+        addr <<= 0x0A
+        assert (ctrl.out_addr.value(), flag.value()) == (3, 0)
+
+
+def test_sparse_ram_indexing():
+    with Simulation():
+        ram = SparseRam(addr_width=16, page_size=0x100)
+        assert ram.ram[0x1234] == 0
+        assert ram.ram[-1] == 0
+        ram.ram[0x1234] = 0
+        assert ram.ram.pages == {}
+        ram.ram[0x1234] = 7
+        ram.ram[-1] = 9
+        assert sorted(ram.ram.pages) == [0x12, 0xFF]
+        assert ram.ram[0x1234] == 7
+        assert ram.ram[0xFFFF] == 9
+        with pytest.raises(IndexError):
+            ram.ram[0x10000]
+        assert list(ram.ram[0x1232:0x1236]) == [0, 0, 7, 0]
+        assert ram.ram[0x1230:0x1238:2] == [0, 0, 7, 0]
+
+
+def test_sparse_ram_slices():
+    with Simulation():
+        ram = SparseRam(addr_width=16, page_size=0x100)
+        # Across a page boundary, skipping the zero page in between.
+        data = bytes(range(1, 17)) + bytes(0x100) + bytes(range(1, 17))
+        ram.ram[0x1F8 : 0x1F8 + len(data)] = data
+        assert sorted(ram.ram.pages) == [0x01, 0x02, 0x03]
+        ram.ram[0x400:0x410] = bytes(16)
+        assert 0x04 not in ram.ram.pages
+        assert bytes(ram.ram[0x1F8 : 0x1F8 + len(data)]) == data
+        ram.ram[0x500:0x508:2] = [1, 2, 3, 4]
+        assert list(ram.ram[0x500:0x508]) == [1, 0, 2, 0, 3, 0, 4, 0]
+        with pytest.raises(ValueError):
+            ram.ram[0:4] = b"abc"
+        assert bytes(ram.dump(0x1F8, 0x208)) == data[:16]
+
+
+def test_sparse_ram_snapshot():
+    with Simulation():
+        ram = SparseRam(addr_width=18, page_size=0x1000)
+        ram.load(b"\x01\x02", base=0x100)
+        before = ram.snapshot()
+        assert set(before) == {0}
+        ram.ram[0x101] = 3
+        ram.ram[0x23456] = 4
+        changed = list(ram.rows(previous=before))
+        assert changed == [
+            (0x100, [1, 3] + [0] * 14, [1, 2] + [0] * 14),
+            (0x23450, [0] * 6 + [4] + [0] * 9, [0] * 16),
+        ]
+        assert list(ram.rows(previous=ram.snapshot())) == []
+
+
+def test_sparse_ram_incremental_snapshot():
+    with Simulation():
+        ram = SparseRam(addr_width=16, page_size=0x100)
+        ram.load(b"\x01", base=0x100)
+        ram.load(b"\x02", base=0x300)
+        assert ram.dirty_pages() == [1, 3]
+        first = ram.snapshot()
+        assert ram.dirty_pages() == []
+
+        ram.ram[0x305] = 5
+        assert ram.dirty_pages() == [3]
+        # Only the dirty page is compared with the latest snapshot, or copied for
+        # the next one.
+        assert [base for base, _, _ in ram._compare(first)] == [0x300]
+        second = ram.snapshot()
+        assert second[1] is first[1] and second[3] is not first[3]
+        assert list(ram.rows(previous=second)) == []
+        # An older snapshot is compared in full.
+        assert list(ram.rows(previous=first)) == [
+            (0x300, [2, 0, 0, 0, 0, 5] + [0] * 10, [2] + [0] * 15)
+        ]
+
+        # Once cleaned, even the latest snapshot is compared (and copied) in full.
+        ram.ram[0x100] = 9
+        ram.clean()
+        assert [base for base, _, _ in ram._compare(second)] == [0x100, 0x300]
+        assert list(ram.rows(previous=second)) == [
+            (0x100, [9] + [0] * 15, [1] + [0] * 15)
+        ]
+        assert ram.snapshot()[1] == b"\x09" + bytes(0xFF)
+
+
+def test_ram_snapshot():
+    with Simulation():
+        ram = Ram(addr_width=8, data_width=16)
+        ram.load([1, 2], base=0x20)
+        before = ram.snapshot()
+        ram.ram[0x21] = 0x1234
+        assert list(ram.rows(previous=before)) == [
+            (0x20, [1, 0x1234] + [0] * 14, [1, 2] + [0] * 14)
+        ]
+
+
+def test_hex_round_trip(tmp_path):
+    path = str(tmp_path / "ram.hex")
+    with Simulation():
+        ram = SparseRam(addr_width=18)
+        ram.load(bytes(range(1, 33)), base=0x10)
+        # A row that crosses the 64K boundary, and one past it.
+        ram.load(bytes(range(1, 17)), base=0xFFF8)
+        ram.load(b"\xaa\xbb", base=0x23456)
+        ram.save_hex(path)
+
+        with open(path) as f:
+            lines = f.read().split()
+        assert ":020000040001F9" in lines
+        assert ":020000040002F8" in lines
+        assert lines[-1] == ":00000001FF"
+
+        records = read_hex(path)
+        assert (0x23450, bytes(6) + b"\xaa\xbb") in records
+        assert all(a >> 16 == (a + len(d) - 1) >> 16 for a, d in records)
+
+        copy = SparseRam(addr_width=18)
+        copy.load_hex(path)
+        assert copy.snapshot() == ram.snapshot()
+
+
+def test_hex_extended_segment_address(tmp_path):
+    path = tmp_path / "seg.hex"
+    path.write_text(":020000021000EC\n:020010000102EB\n:00000001FF\n")
+    assert read_hex(str(path)) == [(0x10010, b"\x01\x02")]
+
+
+def test_hex_bad_checksum(tmp_path):
+    path = tmp_path / "bad.hex"
+    path.write_text(":0200100001020C\n:00000001FF\n")
+    with pytest.raises(Exception, match="bad Intel HEX record"):
+        read_hex(str(path))
+
+
+@pytest.mark.parametrize("data_width", [8, 16])
+def test_binary_round_trip(tmp_path, data_width):
+    path = str(tmp_path / "ram.bin")
+    with Simulation():
+        ram = Ram(addr_width=8, data_width=data_width)
+        ram.load([1, 2, 0, 3], base=0x10)
+        ram.save_binary(path)
+        copy = Ram(addr_width=8, data_width=data_width)
+        copy.load_binary(path)
+        assert list(copy.dump()) == list(ram.dump())
+
+
+def test_binary_partial_word(tmp_path):
+    path = tmp_path / "odd.bin"
+    path.write_bytes(b"\x01\x02\x03")
+    with Simulation():
+        ram = Ram(addr_width=8, data_width=16)
+        with pytest.raises(ValueError, match="odd.bin.*2-byte words"):
+            ram.load_binary(str(path))
@@ -0,0 +1,52 @@
+import pytest
+
+from sim import *
+
+
+@pytest.mark.parametrize("mode", ["delta", "levelized"])
+def test_refreeze_after_connect(mode):
+    with Simulation() as sim:
+        sim.set_mode(mode)
+        clk = Clock(1)
+        counter = Counter(4)
+        counter.clk += clk.clk
+        sim.freeze()
+
+        # Connecting something new makes the next settle freeze again.
+        other = Counter(4)
+        mux = Multiplexer("mux", width=4)
+        mux.a += counter.out
+        mux.b += other.out
+        sim.freeze()
+        for c in (clk, counter, other, mux):
+            c.reset()
+
+        assert set(sim.netlist.components) == {clk, counter, other, mux}
+        assert sorted(c._id for c in sim.netlist.components) == list(range(4))
+        for i in range(1, 6):
+            clk.tick()
+            clk.tick()
+            assert mux.out.value() == i
+
+
+def test_connect_after_settle():
+    with Simulation() as sim:
+        clk = Clock(1)
+        counter = Counter(4)
+        counter.clk += clk.clk
+        clk.reset()
+        counter.reset()
+        clk.tick()
+        assert counter.out.value() == 1
+
+        reg = IORegister("reg", width=4)
+        reg.inp += counter.out
+        reg.we += clk.clk
+        reg.reset()
+        for _ in range(4):
+            clk.tick()
+        # The register's write handler samples its input once the counter, which
+        # counts on the same edge, has updated.
+        assert counter.out.value() == 3
+        assert reg.value() == 3
+        assert reg in sim.netlist.components
@@ -0,0 +1,94 @@
+import json
+
+from sim import *
+
+
+# A clock driving a counter, which drives a multiplexer, profiled for 8 ticks (so
+# 4 counts).
+def profile_counter():
+    sim = simulation()
+    clk = Clock(1)
+    counter = Counter(4)
+    mux = Multiplexer("mux", width=4)
+    counter.clk += clk.clk
+    mux.a += counter.out
+    for c in (clk, counter, mux):
+        c.reset()
+    with sim.profile() as p:
+        for _ in range(8):
+            clk.tick()
+    return p
+
+
+def without_time(rows):
+    for row in rows:
+        assert row.pop("time") >= 0
+    return rows
+
+
+def test_component_counters():
+    with Simulation():
+        p = profile_counter()
+    # The clock is driven 8 times from outside, which wakes the counter every time.
+    # The counter drives its output on every other tick (4 pins, dirtying its bus),
+    # which wakes the multiplexer.
+    assert sorted(without_time(p.rows()), key=lambda row: row["name"]) == [
+        {
+            "name": "clock",
+            "class": "Clock",
+            "updates": 0,
+            "drives": 8,
+            "pins": 8,
+            "nets": 0,
+        },
+        {
+            "name": "counter",
+            "class": "Counter",
+            "updates": 8,
+            "drives": 4,
+            "pins": 16,
+            "nets": 4,
+        },
+        {
+            "name": "mux",
+            "class": "Multiplexer",
+            "updates": 4,
+            "drives": 4,
+            "pins": 16,
+            "nets": 0,
+        },
+    ]
+    classes = without_time(p.rows(by="class", sort="updates"))
+    assert [(row["class"], row["instances"]) for row in classes] == [
+        ("Counter", 1),
+        ("Multiplexer", 1),
+        ("Clock", 1),
+    ]
+
+
+def test_net_counters():
+    with Simulation():
+        p = profile_counter()
+    clk, out = p.net_rows()
+    assert clk["name"] == "counter:clk_0/clock:clk_0"
+    assert (clk["updates"], clk["wakes"], clk["bit_toggles"]) == (8, 8, [7])
+    # The counter goes 1, 2, 3, 4.
+    assert out["width"] == 4 and out["pins"] == 8
+    assert (out["updates"], out["wakes"], out["bit_toggles"]) == (4, 4, [3, 2, 1, 0])
+    assert out["toggles"] == 6 and out["churn"] == 0
+
+
+def test_cpu_ah_16_profile_json(run_cpu, tmp_path):
+    path = tmp_path / "profile.json"
+    run_cpu("cpu_ah_16", "flags.s", "--profile-json", str(path))
+    profile = json.loads(path.read_text())
+    assert set(profile) == {"elapsed", "rows"}
+    assert profile["elapsed"] > 0
+    columns = {"name", "class", "updates", "time", "drives", "pins", "nets"}
+    assert all(set(row) == columns for row in profile["rows"])
+    # Sorted by time, and including e.g. the clock, which is driven but never
+    # updated.
+    times = [row["time"] for row in profile["rows"]]
+    assert times == sorted(times, reverse=True)
+    clock = [row for row in profile["rows"] if row["class"] == "Clock"]
+    assert len(clock) == 1 and clock[0]["updates"] == 0 and clock[0]["drives"] > 0
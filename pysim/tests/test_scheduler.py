@@ -0,0 +1,63 @@
+import pytest
+
+from sim import *
+
+
+# A register loaded from a RAM's data bus, with the RAM's output enable and the
+# register's write enable driven together, as by cpu_ax_13's decoder.
+def ram_to_register(mode):
+    sim = simulation()
+    sim.set_mode(mode)
+    ram = Ram(addr_width=4)
+    ram.load(b"\x0f\x01", base=0)
+    reg = IORegister("reg")
+    control = Component("control")
+    oe = Signal(control, "oe", 1)
+    we = Signal(control, "we", 1)
+    addr = Signal(control, "addr", 4)
+    ram.addr += addr
+    ram.oe += oe
+    ram.data += reg.inp
+    reg.we += we
+    with sim.batch():
+        addr <<= 0
+        oe <<= 0
+        we <<= 0
+    return ram, reg, oe, we
+
+
+@pytest.mark.parametrize("mode", ["delta", "levelized"])
+def test_edge_handler_samples_after_settling(mode):
+    with Simulation() as sim:
+        ram, reg, oe, we = ram_to_register(mode)
+        with sim.batch():
+            oe <<= 1
+            we <<= 1
+        assert reg.value() == 0x0F
+
+
+@pytest.mark.parametrize("mode", ["delta", "levelized"])
+def test_edge_handlers_sample_together(mode):
+    # Two registers clocked by the same edge, the second loaded from the first, shift
+    # rather than both taking the first's input.
+    with Simulation() as sim:
+        sim.set_mode(mode)
+        power = Power()
+        control = Component("control")
+        clk = Signal(control, "clk", 1)
+        inp = Signal(control, "inp", 8)
+        a = IORegister("a")
+        b = IORegister("b")
+        a.inp += inp
+        b.inp += a.state
+        a.we += clk
+        b.we += clk
+        a.oe += power.high
+        b.oe += power.high
+        power.reset()
+        for v in (1, 2, 3):
+            with sim.batch():
+                inp <<= v
+                clk <<= 0
+            clk <<= 1
+            assert (a.value(), b.value()) == (v, v - 1)
@@ -0,0 +1,59 @@
+import os
+import runpy
+
+import pytest
+
+from gates import Not
+from sim import *
+
+
+def ring(n=3):
+    gates = [Not(f"not{i}") for i in range(n)]
+    for a, b in zip(gates, gates[1:] + gates[:1]):
+        a.out += b.inp
+    return gates
+
+
+def test_ring_oscillator_exceeds_budget():
+    with Simulation() as sim:
+        gates = ring()
+        sim.set_settle_budget(100)
+        with pytest.raises(Exception) as e:
+            for g in gates:
+                g.reset()
+        msg = str(e.value)
+        assert "didn't settle after 100 delta cycles" in msg
+        assert "Still changing: not0, not1, not2" in msg
+        assert msg.endswith("combinational loop between not0, not1, not2")
+
+
+def test_settle_budget_can_be_lifted():
+    with Simulation() as sim:
+        with pytest.raises(ValueError):
+            sim.set_settle_budget(0)
+        sim.set_settle_budget(None)
+        # An even ring is stable, so it settles regardless.
+        gates = ring(2)
+        for g in gates:
+            g.reset()
+        assert gates[0].out.value() != gates[1].out.value()
+
+
+def test_demo_08_reports_loop(capsys):
+    with Simulation():
+        runpy.run_path(
+            os.path.join(
+                os.path.dirname(__file__), "..", "demo", "demo_08_oscillator.py"
+            ),
+            run_name="__main__",
+        )
+    out = capsys.readouterr().out
+    assert "Loop: not0, not1, not2" in out
+    assert "Circuit didn't settle after 1000 delta cycles" in out
+
+
+def test_cpu_ah_16_has_no_loops(run_cpu):
+    sims = []
+    out = run_cpu("cpu_ah_16", "flags.s", setup=sims.append)
+    assert "didn't settle" not in out
+    assert sims[0].combinational_loops() == []
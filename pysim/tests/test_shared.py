@@ -0,0 +1,66 @@
+import struct
+import threading
+import time
+
+import pytest
+
+import shared
+from sim import Simulation
+from shared import SharedRam, SharedState
+
+
+def test_shared_ram(tmp_path):
+    path = str(tmp_path / "state")
+    with Simulation():
+        ram = SharedRam(addr_width=8, values=("pc",), path=path)
+        ram.load(b"\x01\x02\x03", base=0x10)
+        ram.shared.publish(5, pc=0x12)
+
+        state = SharedState.attach(path=path)
+        assert state.names() == ["pc"]
+        assert state.snapshot() == (5, {"pc": 0x12})
+        assert bytes(state.ram[0x10:0x13]) == b"\x01\x02\x03"
+        state.close()
+
+        # The contents stay in the Ram once it stops sharing.
+        ram.close()
+        assert not (tmp_path / "state").exists()
+        assert bytes(ram.dump(0x10, 0x13)) == b"\x01\x02\x03"
+        ram.ram[0x10] = 4
+        assert ram.ram[0x10] == 4
+
+
+# Leaves `state` part way through a publish, as if the writer were interrupted.
+def begin_publish(state, cycles):
+    seq = struct.unpack_from("<Q", state._buf, shared._SEQ)[0]
+    struct.pack_into("<Q", state._buf, shared._SEQ, seq + 1)
+    struct.pack_into("<Q", state._buf, shared._CYCLES, cycles)
+    return seq
+
+
+def test_snapshot_waits_for_publish(tmp_path):
+    path = str(tmp_path / "state")
+    state = SharedState.create(16, values=("pc",), path=path)
+    state.publish(1, pc=1)
+    seq = begin_publish(state, 2)
+
+    def finish():
+        time.sleep(0.05)
+        struct.pack_into("<Q", state._buf, shared._SEQ, seq + 2)
+
+    reader = SharedState.attach(path=path)
+    writer = threading.Thread(target=finish)
+    writer.start()
+    # Never sees the half-published cycle count with the old pc.
+    assert reader.snapshot() == (2, {"pc": 1})
+    writer.join()
+    reader.close()
+    state.close()
+
+
+def test_snapshot_times_out(tmp_path):
+    state = SharedState.create(16, values=("pc",), path=str(tmp_path / "state"))
+    begin_publish(state, 2)
+    with pytest.raises(Exception, match="mid-publish"):
+        state.snapshot(timeout=0.05)
+    state.close()
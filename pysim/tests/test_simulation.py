@@ -0,0 +1,74 @@
+import threading
+
+from sim import *
+
+
+def counter(ticks):
+    clk = Clock(1)
+    counter = Counter(8)
+    counter.clk += clk.clk
+    clk.reset()
+    counter.reset()
+    for _ in range(ticks):
+        clk.tick()
+    return counter
+
+
+# What a run of `ticks` looks like in a simulation of its own.
+def expected(ticks):
+    with Simulation() as sim:
+        c = counter(ticks)
+        return c.out.value(), sim.net_updates
+
+
+def test_nested():
+    with Simulation() as outer:
+        a = counter(10)
+        updates = outer.net_updates
+        with Simulation() as inner:
+            assert simulation() is inner
+            b = counter(30)
+        assert simulation() is outer
+        assert a._sim is outer and b._sim is inner
+        assert a in outer.netlist.components and a not in inner.netlist.components
+        assert b in inner.netlist.components and b not in outer.netlist.components
+        # The inner run didn't count towards the outer simulation.
+        assert outer.net_updates == updates
+        assert (a.out.value(), outer.net_updates) == expected(10)
+        assert (b.out.value(), inner.net_updates) == expected(30)
+
+
+def test_threads():
+    ticks = [200, 300]
+    start = threading.Barrier(len(ticks))
+    results = {}
+
+    def run(n):
+        start.wait()
+        with Simulation() as sim:
+            c = counter(n)
+            results[n] = (c.out.value(), sim.net_updates, sim)
+
+    with Simulation() as main:
+        threads = [threading.Thread(target=run, args=(n,)) for n in ticks]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert simulation() is main
+        assert main.net_updates == 0
+
+    for n in ticks:
+        assert results[n][:2] == expected(n)
+    sims = [results[n][2] for n in ticks]
+    assert sims[0] is not sims[1] and main not in sims
+
+
+# A thread doesn't see the simulations made active by other threads.
+def test_thread_has_own_active_simulation():
+    seen = []
+    with Simulation() as main:
+        t = threading.Thread(target=lambda: seen.append(simulation()))
+        t.start()
+        t.join()
+    assert seen[0] is not main
@@ -0,0 +1,52 @@
+import pytest
+
+from sim import *
+
+
+# Records what was called, and with which input value, every time it's woken.
+class Watcher(Component):
+    def __init__(self, trigger, handler):
+        super().__init__("watcher")
+        self.inp = NotifySignal(
+            self, "inp", 1, trigger=trigger, handler=self.on_inp if handler else None
+        )
+        self.seen = []
+
+    def update(self, signal):
+        self.seen.append(("update", self.inp.value()))
+
+    def on_inp(self):
+        self.seen.append(("on_inp", self.inp.value()))
+
+
+@pytest.mark.parametrize(
+    "trigger,handler,expected",
+    [
+        ("change", False, [1, 0, 1, 0]),
+        ("change", True, [1, 0, 1, 0]),
+        ("rising", False, [1, 1]),
+        ("rising", True, [1, 1]),
+        ("falling", False, [0, 0]),
+        ("falling", True, [0, 0]),
+        ("level", True, [1, 0, 1, 0]),
+    ],
+)
+def test_trigger(trigger, handler, expected):
+    with Simulation():
+        out = Signal(Component("driver"), "out", 1)
+        w = Watcher(trigger, handler)
+        out += w.inp
+        for v in (0, 1, 1, 0, 1, 0, 0):
+            out <<= v
+        # A signal with a handler doesn't call update().
+        name = "on_inp" if handler else "update"
+        assert w.seen == [(name, v) for v in expected]
+
+
+def test_bad_trigger():
+    with Simulation():
+        c = Component("c")
+        with pytest.raises(ValueError, match="Unknown trigger"):
+            NotifySignal(c, "a", 1, trigger="edge")
+        with pytest.raises(ValueError, match="Level trigger without a handler"):
+            NotifySignal(c, "b", 1, trigger="level")